@@ -0,0 +1,160 @@
+import secrets
+import time
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from accounts.models import GHLAuthCredentials
+from arman_backend.local_cache import LocalCache
+
+
+CREDENTIALS_CACHE_TTL = 300
+
+# Outbound calls refresh the token themselves when it is this close to expiry
+INLINE_REFRESH_MARGIN = 60
+
+# Longest time a refresh may hold the per-location lock
+REFRESH_LOCK_TIMEOUT = 30
+
+# The token request has to finish well before the lock expires, or a second
+# process could spend the same single-use refresh token
+REFRESH_REQUEST_TIMEOUT = 10
+
+# Delete the lock only while it still holds our value
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+_credentials_cache = LocalCache('ghl-credentials', ttl=CREDENTIALS_CACHE_TTL)
+
+
+def get_credentials(location_id):
+    """
+    Return the GHLAuthCredentials of a location from the process-local cache.
+    A token that is about to expire is refreshed first, or the in-flight
+    refresh of another process is awaited.
+
+    Args:
+        location_id (str): The location ID for the subaccount
+
+    Returns:
+        GHLAuthCredentials or None if the location was never connected
+    """
+    if not location_id:
+        return None
+    credentials = _credentials_cache.get(location_id, lambda: _load_credentials(location_id))
+    if credentials and expires_within(credentials, INLINE_REFRESH_MARGIN):
+        credentials = refresh_credentials(location_id) or credentials
+    return credentials
+
+
+def invalidate_credentials(location_id=None):
+    """
+    Drop the cached credentials of a location (or of all locations) in every process
+    """
+    _credentials_cache.invalidate(location_id)
+
+
+def expires_within(credentials, seconds):
+    expires_at = credentials.expires_at
+    return expires_at is not None and expires_at - timedelta(seconds=seconds) <= timezone.now()
+
+
+def store_tokens(token_data):
+    """
+    Save the response of the GHL token endpoint for its location
+    """
+    obj, created = GHLAuthCredentials.objects.update_or_create(
+        location_id=token_data.get("locationId"),
+        defaults={
+            "access_token": token_data.get("access_token"),
+            "refresh_token": token_data.get("refresh_token"),
+            "expires_in": token_data.get("expires_in"),
+            "scope": token_data.get("scope"),
+            "user_type": token_data.get("userType"),
+            "company_id": token_data.get("companyId"),
+            "user_id": token_data.get("userId"),
+            "issued_at": timezone.now(),
+        }
+    )
+    return obj
+
+
+def refresh_credentials(location_id, margin=INLINE_REFRESH_MARGIN):
+    """
+    Exchange the refresh token of a location for a new token pair.
+
+    Only one process refreshes a location at a time; the others wait for it
+    to finish and read the stored result. Tokens that no longer expire within
+    ``margin`` seconds (because someone else refreshed them) are left alone.
+
+    Returns:
+        GHLAuthCredentials or None if the refresh failed
+    """
+    lock_key = f"ghl-token-refresh:{location_id}"
+    # An int is stored as plain digits by the Redis cache backend, so the release script can compare it
+    lock_value = secrets.randbits(62)
+
+    if not cache.add(lock_key, lock_value, timeout=REFRESH_LOCK_TIMEOUT):
+        wait_for_refresh(location_id)
+        return _load_credentials(location_id)
+
+    try:
+        credentials = _load_credentials(location_id)
+        if not credentials:
+            return None
+        if credentials.expires_at is not None and not expires_within(credentials, margin):
+            return credentials
+
+        response = requests.post(settings.TOKEN_URL, data={
+            'grant_type': 'refresh_token',
+            'client_id': settings.CLIENT_ID,
+            'client_secret': settings.CLIENT_SECRET,
+            'refresh_token': credentials.refresh_token
+        }, timeout=REFRESH_REQUEST_TIMEOUT)
+        new_tokens = response.json()
+        if response.status_code != 200 or not new_tokens.get("access_token"):
+            print(f"Token refresh failed for {location_id}: {response.status_code} - {response.text}")
+            return None
+
+        new_tokens.setdefault("locationId", location_id)
+        return store_tokens(new_tokens)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"Token refresh failed for {location_id}: {e}")
+        return None
+    finally:
+        release_lock(lock_key, lock_value)
+
+
+def release_lock(lock_key, lock_value):
+    """
+    Release a cache lock taken with ``cache.add`` unless it expired and someone else holds it now
+    """
+    backend = getattr(cache, '_cache', None)
+    if hasattr(backend, 'get_client'):
+        # Redis: compare and delete in one step
+        key = cache.make_and_validate_key(lock_key)
+        backend.get_client(key, write=True).eval(RELEASE_LOCK_SCRIPT, 1, key, lock_value)
+    elif cache.get(lock_key) == lock_value:
+        # Process-local backends (development) have no other process to race with
+        cache.delete(lock_key)
+
+
+def wait_for_refresh(location_id, timeout=REFRESH_LOCK_TIMEOUT):
+    """
+    Block until the in-flight refresh of a location releases its lock
+    """
+    lock_key = f"ghl-token-refresh:{location_id}"
+    deadline = time.monotonic() + timeout
+    while cache.get(lock_key) and time.monotonic() < deadline:
+        time.sleep(0.2)
+
+
+def _load_credentials(location_id):
+    return GHLAuthCredentials.objects.filter(location_id=location_id).first()
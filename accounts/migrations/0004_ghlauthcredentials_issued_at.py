@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-19 10:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("accounts", "0003_alter_ghlauthcredentials_scope"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ghlauthcredentials",
+            name="issued_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
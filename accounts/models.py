@@ -1,3 +1,4 @@
+from datetime import timedelta
 from django.db import models
 
 
@@ -10,6 +11,14 @@ class GHLAuthCredentials(models.Model):
     user_type = models.CharField(max_length=50, null=True, blank=True)
     company_id = models.CharField(max_length=255, null=True, blank=True)
     location_id = models.CharField(max_length=255, null=True, blank=True)
+    issued_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
-        return f"{self.user_id} - {self.company_id}"
\ No newline at end of file
+        return f"{self.user_id} - {self.company_id}"
+
+    @property
+    def expires_at(self):
+        """When the access token expires, None if it was stored before issued_at was tracked"""
+        if not self.issued_at:
+            return None
+        return self.issued_at + timedelta(seconds=self.expires_in)
\ No newline at end of file
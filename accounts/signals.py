@@ -0,0 +1,12 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from accounts.models import GHLAuthCredentials
+from accounts.credentials import invalidate_credentials
+
+
+@receiver([post_save, post_delete], sender=GHLAuthCredentials)
+def credentials_changed(sender, instance, **kwargs):
+    # Wait for the commit so other processes don't reload the old tokens
+    location_id = instance.location_id
+    transaction.on_commit(lambda: invalidate_credentials(location_id))
@@ -1,42 +1,30 @@
-import requests
 from celery import shared_task
-from accounts.models import GHLAuthCredentials
 from django.conf import settings
+from django.utils import timezone
+from accounts.models import GHLAuthCredentials
+from accounts.credentials import refresh_credentials
 from accounts.utils import fetch_all_contacts
 
 
 @shared_task
-def make_api_for_ghl():
-    
-    credentials = GHLAuthCredentials.objects.first()
-    
-    print("credentials tokenL", credentials)
-    refresh_token = credentials.refresh_token
+def refresh_expiring_tokens():
+    """
+    Queue a refresh for every location whose token expires within the refresh margin.
+    Rows stored before issued_at was tracked are refreshed right away.
+    """
+    margin = settings.GHL_TOKEN_REFRESH_MARGIN
+    now = timezone.now()
 
-    
-    response = requests.post('https://services.leadconnectorhq.com/oauth/token', data={
-        'grant_type': 'refresh_token',
-        'client_id': settings.CLIENT_ID,
-        'client_secret': settings.CLIENT_SECRET,
-        'refresh_token': refresh_token
-    })
-    
-    new_tokens = response.json()
-    print("newtoken :", new_tokens)
+    for credentials in GHLAuthCredentials.objects.exclude(location_id__isnull=True):
+        expires_at = credentials.expires_at
+        if expires_at is None or (expires_at - now).total_seconds() <= margin:
+            refresh_location_token.delay(credentials.location_id)
 
-    obj, created = GHLAuthCredentials.objects.update_or_create(
-            location_id= new_tokens.get("locationId"),
-            defaults={
-                "access_token": new_tokens.get("access_token"),
-                "refresh_token": new_tokens.get("refresh_token"),
-                "expires_in": new_tokens.get("expires_in"),
-                "scope": new_tokens.get("scope"),
-                "user_type": new_tokens.get("userType"),
-                "company_id": new_tokens.get("companyId"),
-                "user_id":new_tokens.get("userId"),
 
-            }
-        )
+@shared_task
+def refresh_location_token(location_id):
+    credentials = refresh_credentials(location_id, margin=settings.GHL_TOKEN_REFRESH_MARGIN)
+    print("credentials refreshed:", location_id, bool(credentials))
 
 @shared_task
 def fetch_all_contacts_task(location_id, access_token):
@@ -44,4 +32,3 @@ def fetch_all_contacts_task(location_id, access_token):
     Celery task to fetch all contacts for a given location using the provided access token.
     """
     fetch_all_contacts(location_id, access_token)
-
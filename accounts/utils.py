@@ -3,12 +3,17 @@ import time
 from typing import List, Dict, Any, Optional
 from django.utils.dateparse import parse_datetime
 from django.db import transaction
-from data_management_app.models import Contact, Address
+from data_management_app.models import Contact, Address, phone_lookup_fields
+from data_management_app import typeahead
 from accounts.models import GHLAuthCredentials
 from django.core.exceptions import ObjectDoesNotExist
+from django.core.cache import cache
 import re
 
 
+CUSTOM_FIELDS_CACHE_TTL = 3600
+
+
 def fetch_all_contacts(location_id: str, access_token: str = None) -> List[Dict[str, Any]]:
     """
     Fetch all contacts from GoHighLevel API with proper pagination handling.
@@ -147,19 +152,21 @@ def fetch_all_contacts(location_id: str, access_token: str = None) -> List[Dict[
     
     print(f"\nTotal contacts retrieved: {len(all_contacts)}")
 
-    sync_contacts_to_db(all_contacts)
+    sync_contacts_to_db(all_contacts, location_id)
     fetch_contacts_locations(all_contacts, location_id, access_token)
     # return all_contacts
 
 
 
 
-def sync_contacts_to_db(contact_data):
+def sync_contacts_to_db(contact_data, location_id=None):
     """
     Syncs contact data from API into the local Contact model using bulk upsert.
-    Also deletes any Contact objects not present in the incoming contact_data.
+    Also deletes the location's Contact objects not present in the incoming contact_data.
     Args:
         contact_data (list): List of contact dicts from GoHighLevel API
+        location_id (str): Location the contacts were fetched for; defaults to the
+            locations found in contact_data
     """
     contacts_to_create = []
     incoming_ids = set(c['id'] for c in contact_data)
@@ -179,7 +186,8 @@ def sync_contacts_to_db(contact_data):
             tags=item.get("tags", []),
             custom_fields=item.get("customFields", []),
             location_id=item.get("locationId"),
-            timestamp=date_added
+            timestamp=date_added,
+            **phone_lookup_fields(item.get("phone"))
         )
         if item.get("id") in existing_ids:
             # Update existing contact
@@ -187,6 +195,8 @@ def sync_contacts_to_db(contact_data):
                 first_name=contact_obj.first_name,
                 last_name=contact_obj.last_name,
                 phone=contact_obj.phone,
+                phone_digits=contact_obj.phone_digits,
+                phone_digits_reversed=contact_obj.phone_digits_reversed,
                 email=contact_obj.email,
                 dnd=contact_obj.dnd,
                 country=contact_obj.country,
@@ -203,8 +213,13 @@ def sync_contacts_to_db(contact_data):
         with transaction.atomic():
             Contact.objects.bulk_create(contacts_to_create, ignore_conflicts=True)
 
-    # Delete contacts not present in the incoming data
-    deleted_count, _ = Contact.objects.exclude(contact_id__in=incoming_ids).delete()
+    # Delete contacts of the synced location(s) not present in the incoming data
+    location_ids = {location_id} if location_id else {c.get('locationId') for c in contact_data if c.get('locationId')}
+    deleted_count = 0
+    for loc_id in location_ids:
+        deleted, _ = Contact.objects.for_location(loc_id).exclude(contact_id__in=incoming_ids).delete()
+        deleted_count += deleted
+        typeahead.reload_location(loc_id)
 
     print(f"{len(contacts_to_create)} new contacts created.")
     print(f"{len(existing_ids)} existing contacts updated.")
@@ -214,7 +229,7 @@ def sync_contacts_to_db(contact_data):
 
 def fetch_contacts_locations(contact_data: list, location_id: str, access_token: str) -> dict:
     # Fetch location custom fields
-    location_custom_fields = fetch_location_custom_fields(location_id, access_token)
+    location_custom_fields = get_location_custom_fields(location_id, access_token)
 
     headers = {
         "Accept": "application/json",
@@ -237,26 +252,8 @@ def fetch_contacts_locations(contact_data: list, location_id: str, access_token:
                 continue
             data = response.json()
             contact_detail = data.get('contact', {})
-            # --- Address 0 extraction ---
-            address_fields = {
-                'street_address': contact_detail.get('address1'),
-                'city': contact_detail.get('city'),
-                'state': contact_detail.get('state'),
-                'postal_code': contact_detail.get('postalCode'),
-                # 'country': contact_detail.get('country'),  # Uncomment if Address model has country
-                'address_id': 'address_0',
-                'order': 0,
-                'name': 'Address 0',
-                'contact_id': contact_id
-            }
-            # Only save if at least one address field is present
-            if any(address_fields.get(f) for f in ['street_address', 'city', 'state', 'postal_code']):
-                sync_addresses_to_db([address_fields])
-            # --- Custom fields addresses ---
-            custom_fields = contact_detail.get('customFields', [])
-            if custom_fields and any(cf.get('value') for cf in custom_fields):
-                create_address_from_custom_fields(contact_id, custom_fields, location_custom_fields)
-                # Add a small delay to be respectful to the API
+            sync_contact_addresses(contact_id, contact_detail, location_custom_fields)
+            # Add a small delay to be respectful to the API
             time.sleep(0.2)
 
         except requests.exceptions.RequestException as e:
@@ -264,6 +261,49 @@ def fetch_contacts_locations(contact_data: list, location_id: str, access_token:
             continue
 
 
+def sync_contact_addresses(contact_id: str, contact_detail: dict, location_custom_fields: dict):
+    """
+    Save the addresses carried by a GHL contact payload: the standard address as
+    'Address 0' and the custom-field address groups as Address 1..10.
+
+    Args:
+        contact_id (str): The contact's unique ID (should exist in Contact model)
+        contact_detail (dict): Contact payload from the contact API or a webhook
+        location_custom_fields (dict): Output of get_location_custom_fields
+    """
+    # --- Address 0 extraction ---
+    address_fields = {
+        'street_address': contact_detail.get('address1'),
+        'city': contact_detail.get('city'),
+        'state': contact_detail.get('state'),
+        'postal_code': contact_detail.get('postalCode'),
+        # 'country': contact_detail.get('country'),  # Uncomment if Address model has country
+        'address_id': 'address_0',
+        'order': 0,
+        'name': 'Address 0',
+        'contact_id': contact_id
+    }
+    # Only save if at least one address field is present
+    if any(address_fields.get(f) for f in ['street_address', 'city', 'state', 'postal_code']):
+        sync_addresses_to_db([address_fields])
+    # --- Custom fields addresses ---
+    custom_fields = contact_detail.get('customFields', [])
+    if custom_fields and any(cf.get('value') for cf in custom_fields):
+        create_address_from_custom_fields(contact_id, custom_fields, location_custom_fields)
+
+
+def get_location_custom_fields(location_id: str, access_token: str) -> dict:
+    """
+    Cached fetch_location_custom_fields; the schema of a location rarely changes.
+    """
+    key = f"ghl-custom-fields:{location_id}"
+    location_custom_fields = cache.get(key)
+    if location_custom_fields is None:
+        location_custom_fields = fetch_location_custom_fields(location_id, access_token)
+        cache.set(key, location_custom_fields, timeout=CUSTOM_FIELDS_CACHE_TTL)
+    return location_custom_fields
+
+
 def fetch_location_custom_fields(location_id: str, access_token: str) -> dict:
     """
     Fetch custom fields for a given location from GoHighLevel API and return a dict with id as key and a dict of name, fieldKey, parentId as value.
@@ -1,6 +1,6 @@
 from django.shortcuts import render,redirect
 from django.conf import settings
-from accounts.models import GHLAuthCredentials
+from accounts.credentials import store_tokens
 import requests
 from django.http import JsonResponse
 from django.contrib.auth import authenticate
@@ -62,19 +62,7 @@ def tokens(request):
         if not response_data:
             return
 
-        obj, created = GHLAuthCredentials.objects.update_or_create(
-            location_id= response_data.get("locationId"),
-            defaults={
-                "access_token": response_data.get("access_token"),
-                "refresh_token": response_data.get("refresh_token"),
-                "expires_in": response_data.get("expires_in"),
-                "scope": response_data.get("scope"),
-                "user_type": response_data.get("userType"),
-                "company_id": response_data.get("companyId"),
-                "user_id":response_data.get("userId"),
-
-            }
-        )
+        obj = store_tokens(response_data)
 
         fetch_all_contacts_task.delay(response_data.get("locationId"), response_data.get("access_token"))
         
@@ -0,0 +1,136 @@
+"""
+Process-local caches kept coherent across web and worker processes.
+
+Every process holds its own copy of hot rows in memory. Writers call
+``invalidate`` which drops the local copy and publishes the key on a Redis
+channel, so the other processes drop theirs as well. When Redis is not
+reachable the entries still expire after their TTL.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+
+import redis
+from django.conf import settings
+
+
+CHANNEL = 'arman-backend:broadcast'
+
+_instance_id = uuid.uuid4().hex
+_handlers = {}
+_client = None
+_listener_pid = None
+_listener_lock = threading.Lock()
+
+
+def subscribe(topic, handler):
+    """
+    Register ``handler(message)`` for a topic published by any process
+    """
+    _handlers.setdefault(topic, []).append(handler)
+
+
+def publish(topic, message):
+    """
+    Run the local handlers for ``topic`` and fan the message out to the other processes
+    """
+    global _client
+    _dispatch(topic, message)
+    try:
+        if _client is None:
+            _client = redis.Redis.from_url(settings.REDIS_URL)
+        _client.publish(CHANNEL, json.dumps({'sender': _sender_id(), 'topic': topic, 'message': message}))
+    except redis.RedisError as e:
+        print(f"Broadcast of {topic} failed: {e}")
+
+
+def ensure_listener():
+    """
+    Start the subscriber thread once per process (forked workers start their own)
+    """
+    global _listener_pid
+    if _listener_pid == os.getpid():
+        return
+    with _listener_lock:
+        if _listener_pid == os.getpid():
+            return
+        _listener_pid = os.getpid()
+        thread = threading.Thread(target=_listen, name='local-cache-listener', daemon=True)
+        thread.start()
+
+
+def _sender_id():
+    # Forked workers inherit the module state, the pid keeps them apart
+    return f'{_instance_id}:{os.getpid()}'
+
+
+def _dispatch(topic, message):
+    for handler in _handlers.get(topic, []):
+        try:
+            handler(message)
+        except Exception as e:
+            print(f"Broadcast handler for {topic} failed: {e}")
+
+
+def _listen():
+    reported = False
+    while True:
+        try:
+            client = redis.Redis.from_url(settings.REDIS_URL)
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(CHANNEL)
+            reported = False
+            for item in pubsub.listen():
+                payload = json.loads(item['data'])
+                if payload.get('sender') != _sender_id():
+                    _dispatch(payload.get('topic'), payload.get('message'))
+        except Exception as e:
+            if not reported:
+                print(f"Broadcast listener disconnected: {e}")
+                reported = True
+            time.sleep(5)
+
+
+class LocalCache:
+    """
+    Small TTL cache living in the memory of the current process
+    """
+
+    def __init__(self, name, ttl):
+        self.name = name
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        subscribe(f'local-cache:{name}', self._on_invalidate)
+
+    def get(self, key, loader):
+        """
+        Return the cached value for ``key``, calling ``loader()`` on a miss.
+        ``None`` results are not cached.
+        """
+        ensure_listener()
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+
+        value = loader()
+        if value is not None:
+            with self._lock:
+                self._entries[key] = (time.monotonic() + self.ttl, value)
+        return value
+
+    def invalidate(self, key=None):
+        """
+        Drop ``key`` (or every entry when no key is given) in all processes
+        """
+        publish(f'local-cache:{self.name}', {'key': key})
+
+    def _on_invalidate(self, message):
+        key = message.get('key')
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
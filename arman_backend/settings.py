@@ -46,6 +46,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'django_celery_beat',
     'rest_framework',
     'corsheaders',
@@ -179,19 +180,52 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
-CELERY_BROKER_URL = 'redis://localhost:6379/0'
-CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
+REDIS_URL = 'redis://localhost:6379/0'
+
+CELERY_BROKER_URL = REDIS_URL
+CELERY_RESULT_BACKEND = REDIS_URL
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://localhost:6379/1',
+    }
+}
+
+
+# Invoice jobs allowed to start per location within each rate window (seconds)
+GHL_INVOICE_RATE_LIMIT = 20
+GHL_INVOICE_RATE_WINDOW = 10
+# Transient GHL errors (network, 429, 5xx) are retried with exponential backoff, in seconds
+GHL_INVOICE_MAX_ATTEMPTS = 5
+GHL_INVOICE_RETRY_BACKOFF = 30
+GHL_INVOICE_RETRY_BACKOFF_MAX = 600
+# Pending/processing jobs untouched for this long are requeued (lost enqueue or dead worker)
+GHL_INVOICE_STALE_AFTER = 60 * 15
+
+
 from celery.schedules import crontab
 
 CELERY_BEAT_SCHEDULE = {
     'make-api-call-every-minute': {
-        'task': 'accounts.tasks.make_api_for_ghl',
-        'schedule': 3000.0,# every 60 seconds
+        'task': 'accounts.tasks.refresh_expiring_tokens',
+        'schedule': 60.0,# every 60 seconds
+    },
+    'requeue-stale-invoice-jobs': {
+        'task': 'data_management_app.tasks.requeue_stale_invoice_jobs',
+        'schedule': 300.0,# every 5 minutes
     },
-}
\ No newline at end of file
+}
+
+# Tokens are refreshed this many seconds before they expire
+GHL_TOKEN_REFRESH_MARGIN = 900
+# Load the contact autocomplete index of every location when a web worker starts
+TYPEAHEAD_WARM_ON_START = True
+# Reject quotes whose total_amount differs from the server-side price; when off the
+# mismatch is only logged (the priced total is stored either way)
+PRICING_STRICT = True
@@ -14,3 +14,14 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'arman_backend.settings')
 
 application = get_wsgi_application()
+
+from django.conf import settings  # noqa: E402
+
+if settings.TYPEAHEAD_WARM_ON_START:
+    from data_management_app.typeahead import warm_indexes  # noqa: E402
+
+    try:
+        warm_indexes()
+    except Exception as e:
+        # Indexes load lazily on the first lookup instead
+        print(f"Typeahead warm-up failed: {e}")
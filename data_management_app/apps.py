@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class DataManagementAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'data_management_app'
+
+    def ready(self):
+        import data_management_app.signals  # noqa: F401
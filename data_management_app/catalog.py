@@ -0,0 +1,416 @@
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from .models import Feature, PricingOption, PricingOptionFeature, Question, QuestionOption, Service
+
+
+CHOICE_TYPES = ['choice', 'multiple_choice', 'extra_choice']
+
+# Every catalog write moves this counter, which retires all cached catalog responses
+CATALOG_VERSION_KEY = 'catalog:version'
+CATALOG_RESPONSE_TTL = 60 * 60 * 24
+
+
+def catalog_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # Start from the clock so a lost counter never reuses an old version
+        cache.add(CATALOG_VERSION_KEY, time.time_ns() // 1000, timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    """
+    Retire the cached catalog responses once the current transaction commits
+    """
+    # One increment per transaction is enough, however many rows it writes
+    connection = transaction.get_connection()
+    if connection.in_atomic_block and any(
+        callback[1] is _increment_catalog_version for callback in connection.run_on_commit
+    ):
+        return
+    transaction.on_commit(_increment_catalog_version)
+
+
+def _increment_catalog_version():
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        catalog_version()
+
+
+def cached_catalog_response(request, build):
+    """
+    Rendered body and strong ETag of a catalog read, cached per catalog version
+    and request (path and query string).
+
+    Args:
+        request: DRF request of the read
+        build (callable): returns the rendered JSON bytes on a cache miss
+
+    Returns:
+        tuple (content, etag)
+    """
+    query = urlencode(sorted(request.query_params.lists()), doseq=True)
+    digest = hashlib.sha256(f"{request.path}?{query}".encode()).hexdigest()
+    key = f"catalog:{catalog_version()}:{digest}"
+
+    cached = cache.get(key)
+    if cached is None:
+        content = build()
+        cached = (content, f'"{hashlib.sha256(content).hexdigest()}"')
+        cache.set(key, cached, CATALOG_RESPONSE_TTL)
+    return cached
+
+
+def _option_pairs(options_data):
+    # Options arrive as [{label: value}, ...] in display order, optionally with the option 'id'
+    pairs = []
+    for option in options_data:
+        option = dict(option)
+        option_id = option.pop('id', None)
+        label, value = list(option.items())[0]
+        pairs.append((option_id, label, value))
+    return pairs
+
+
+def _set_changed(obj, values):
+    """Assign ``values`` to ``obj`` and return the names of the fields that changed"""
+    changed = []
+    for field, value in values.items():
+        if getattr(obj, field) != value:
+            setattr(obj, field, value)
+            changed.append(field)
+    return changed
+
+
+class _BulkWriter:
+    """
+    Collects row changes per model and writes them with one statement per model and kind
+    """
+
+    def __init__(self):
+        self.updates = {}
+
+    def update(self, obj, fields):
+        if fields:
+            obj_fields = self.updates.setdefault(type(obj), {}).setdefault(obj.pk, (obj, set()))[1]
+            obj_fields.update(fields)
+
+    def flush_updates(self, model, unique_field=None):
+        """
+        Write the collected updates of ``model``. Rows changing ``unique_field``
+        first move to a placeholder value, so rows can swap values in one update.
+        """
+        updates = self.updates.pop(model, {})
+        if not updates:
+            return
+        objs = [obj for obj, _ in updates.values()]
+        fields = set().union(*(obj_fields for _, obj_fields in updates.values()))
+        renamed = [obj for obj, obj_fields in updates.values() if unique_field in obj_fields]
+        if renamed:
+            values = [getattr(obj, unique_field) for obj in renamed]
+            for obj in renamed:
+                setattr(obj, unique_field, f"__renaming_{obj.pk}__")
+            model.objects.bulk_update(renamed, [unique_field])
+            for obj, value in zip(renamed, values):
+                setattr(obj, unique_field, value)
+        model.objects.bulk_update(objs, sorted(fields))
+
+
+def create_services(services_data):
+    """
+    Create services with their features, questions, options, pricing options and
+    feature links from validated ServiceSerializer payloads, with one bulk INSERT
+    per model whatever the number of services.
+
+    Returns:
+        list of the created Service objects, in payload order
+    """
+    services, features, questions, options, pricing_options, pending_links = [], [], [], [], [], []
+
+    with transaction.atomic():
+        for service_data in services_data:
+            services.append(Service(name=service_data['name'], description=service_data.get('description', '')))
+        Service.objects.bulk_create(services)
+
+        for service, service_data in zip(services, services_data):
+            feature_mapping = {}  # Map frontend IDs to actual Feature objects
+            for feature_data in service_data.get('features', []):
+                feature = Feature(
+                    service=service, name=feature_data['name'], description=feature_data.get('description', '')
+                )
+                features.append(feature)
+                if feature_data.get('id'):
+                    feature_mapping[feature_data['id']] = feature
+
+            for question_data in service_data.get('questions', []):
+                question = Question(
+                    service=service,
+                    text=question_data['text'],
+                    type=question_data['type'],
+                    unit_price=question_data.get('unit_price', 0),
+                    is_required=question_data.get('is_required', False),
+                    order=question_data.get('order', 0),
+                )
+                questions.append(question)
+                if question.type in CHOICE_TYPES:
+                    for order, (_, label, value) in enumerate(_option_pairs(question_data.get('options', []))):
+                        options.append(QuestionOption(question=question, value=value, label=label or value, order=order))
+
+            for pricing_data in service_data.get('pricingOptions', []):
+                pricing_option = PricingOption(
+                    service=service,
+                    name=pricing_data['name'],
+                    discount=pricing_data.get('discount', 0),
+                    base_price=pricing_data.get('base_price', 0),
+                )
+                pricing_options.append(pricing_option)
+                for selected_feature in pricing_data.get('selectedFeatures', []):
+                    if selected_feature['id'] in feature_mapping:
+                        pending_links.append(
+                            (pricing_option, feature_mapping[selected_feature['id']], selected_feature['is_included'])
+                        )
+
+        # Parents are inserted before children so the foreign keys are set
+        Feature.objects.bulk_create(features)
+        Question.objects.bulk_create(questions)
+        QuestionOption.objects.bulk_create(options)
+        PricingOption.objects.bulk_create(pricing_options)
+        links = [
+            PricingOptionFeature(pricing_option=pricing_option, feature=feature, is_included=is_included)
+            for pricing_option, feature, is_included in pending_links
+        ]
+        PricingOptionFeature.objects.bulk_create(links)
+        bump_catalog_version()
+    return services
+
+
+def clone_service(service, name=None):
+    """
+    Copy a service with its features, questions, options, pricing options and
+    feature links inside the database: one INSERT ... SELECT per table, whatever
+    the size of the service.
+
+    Features and pricing options of the copy are matched to the originals by
+    their unique name, questions by their position in id order.
+
+    Returns:
+        the new Service
+    """
+    tables = {
+        'service': Service._meta.db_table,
+        'feature': Feature._meta.db_table,
+        'pricing_option': PricingOption._meta.db_table,
+        'link': PricingOptionFeature._meta.db_table,
+        'question': Question._meta.db_table,
+        'option': QuestionOption._meta.db_table,
+    }
+    params = {'source': service.pk, 'name': name or f"{service.name} (Copy)"}
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"""INSERT INTO {tables['service']} (name, description, is_active, created_at, updated_at)
+            SELECT %(name)s, description, TRUE, now(), now() FROM {tables['service']} WHERE id = %(source)s
+            RETURNING id""",
+            params,
+        )
+        params['target'] = cursor.fetchone()[0]
+
+        cursor.execute(
+            f"""INSERT INTO {tables['feature']} (service_id, name, description, created_at)
+            SELECT %(target)s, name, description, now() FROM {tables['feature']}
+            WHERE service_id = %(source)s ORDER BY id""",
+            params,
+        )
+        cursor.execute(
+            f"""INSERT INTO {tables['pricing_option']} (service_id, name, discount, base_price, is_active, created_at)
+            SELECT %(target)s, name, discount, base_price, is_active, now() FROM {tables['pricing_option']}
+            WHERE service_id = %(source)s ORDER BY id""",
+            params,
+        )
+        cursor.execute(
+            f"""INSERT INTO {tables['link']} (pricing_option_id, feature_id, is_included, created_at)
+            SELECT new_po.id, new_f.id, link.is_included, now()
+            FROM {tables['link']} link
+            JOIN {tables['pricing_option']} old_po ON old_po.id = link.pricing_option_id
+            JOIN {tables['feature']} old_f ON old_f.id = link.feature_id
+            JOIN {tables['pricing_option']} new_po ON new_po.service_id = %(target)s AND new_po.name = old_po.name
+            JOIN {tables['feature']} new_f ON new_f.service_id = %(target)s AND new_f.name = old_f.name
+            WHERE old_po.service_id = %(source)s""",
+            params,
+        )
+        cursor.execute(
+            f"""INSERT INTO {tables['question']} (service_id, text, type, unit_price, is_required, "order", is_active, created_at)
+            SELECT %(target)s, text, type, unit_price, is_required, "order", is_active, now() FROM {tables['question']}
+            WHERE service_id = %(source)s ORDER BY id""",
+            params,
+        )
+        cursor.execute(
+            f"""INSERT INTO {tables['option']} (question_id, value, label, additional_price, "order", is_active)
+            SELECT new_q.id, option.value, option.label, option.additional_price, option."order", option.is_active
+            FROM {tables['option']} option
+            JOIN (
+                SELECT id, row_number() OVER (ORDER BY id) AS position FROM {tables['question']} WHERE service_id = %(source)s
+            ) old_q ON old_q.id = option.question_id
+            JOIN (
+                SELECT id, row_number() OVER (ORDER BY id) AS position FROM {tables['question']} WHERE service_id = %(target)s
+            ) new_q ON new_q.position = old_q.position""",
+            params,
+        )
+        bump_catalog_version()
+
+    return Service.objects.get(pk=params['target'])
+
+
+def update_service_graph(service, features_data=None, pricing_options_data=None, questions_data=None):
+    """
+    Bring the features, pricing options and questions of a service in line with
+    the nested payload of ServiceSerializer, keeping the ids of unchanged rows.
+
+    Rows are matched by id (pricing options also by name, question options also
+    by label); only new rows are inserted, changed rows updated and missing rows
+    deleted, each in bulk. A collection passed as None is left untouched.
+    Feature ids the client made up for new features can be referenced by
+    ``selectedFeatures`` and are mapped to the created rows.
+    """
+    writer = _BulkWriter()
+    with transaction.atomic():
+        feature_mapping = {feature.id: feature for feature in service.features.all()}
+        if features_data is not None:
+            feature_mapping = _sync_features(service, features_data, writer)
+        if questions_data is not None:
+            _sync_questions(service, questions_data, writer)
+        if pricing_options_data is not None:
+            _sync_pricing_options(service, pricing_options_data, feature_mapping, writer)
+        bump_catalog_version()
+    return service
+
+
+def _sync_features(service, features_data, writer):
+    existing = {feature.id: feature for feature in service.features.all()}
+    keep, to_create, feature_mapping = set(), [], {}
+
+    for feature_data in features_data:
+        values = {'name': feature_data['name'], 'description': feature_data.get('description', '')}
+        frontend_id = feature_data.get('id')
+        feature = existing.get(frontend_id)
+        if feature is not None and frontend_id not in keep:
+            keep.add(frontend_id)
+            writer.update(feature, _set_changed(feature, values))
+        else:
+            feature = Feature(service=service, **values)
+            to_create.append(feature)
+        if frontend_id is not None:
+            feature_mapping[frontend_id] = feature
+
+    # Deletes go first so a re-added name doesn't hit the (service, name) constraint
+    Feature.objects.filter(id__in=set(existing) - keep).delete()
+    writer.flush_updates(Feature, unique_field='name')
+    Feature.objects.bulk_create(to_create)
+    return feature_mapping
+
+
+def _sync_questions(service, questions_data, writer):
+    existing = {question.id: question for question in service.questions.prefetch_related('options')}
+    keep, to_create, options_by_question = set(), [], []
+
+    for question_data in questions_data:
+        values = {
+            'text': question_data['text'],
+            'type': question_data['type'],
+            'unit_price': question_data.get('unit_price', 0),
+            'is_required': question_data.get('is_required', False),
+            'order': question_data.get('order', 0),
+        }
+        question = existing.get(question_data.get('id'))
+        if question is not None and question.id not in keep:
+            keep.add(question.id)
+            writer.update(question, _set_changed(question, values))
+        else:
+            question = Question(service=service, **values)
+            to_create.append(question)
+        options_by_question.append((question, _option_pairs(question_data.get('options', []))))
+
+    Question.objects.filter(id__in=set(existing) - keep).delete()
+    writer.flush_updates(Question)
+    Question.objects.bulk_create(to_create)
+
+    stale_options, new_options = [], []
+    for question, pairs in options_by_question:
+        by_id, by_label = {}, {}
+        if question.id in keep:
+            for option in question.options.all():
+                by_id[option.id] = option
+                by_label.setdefault(option.label, option)
+        if question.type not in CHOICE_TYPES:
+            pairs = []
+        for order, (option_id, label, value) in enumerate(pairs):
+            # Options are stored with their value as label when the label is empty
+            label = label or value
+            option = by_id.pop(option_id, None) or by_id.pop(getattr(by_label.get(label), 'id', None), None)
+            if option is None:
+                new_options.append(QuestionOption(question=question, value=value, label=label, order=order))
+            else:
+                writer.update(option, _set_changed(option, {'label': label, 'value': value, 'order': order}))
+        stale_options.extend(by_id)
+
+    QuestionOption.objects.filter(id__in=stale_options).delete()
+    writer.flush_updates(QuestionOption)
+    QuestionOption.objects.bulk_create(new_options)
+
+
+def _sync_pricing_options(service, pricing_options_data, feature_mapping, writer):
+    existing = list(service.pricing_options.prefetch_related('selected_features'))
+    by_id = {pricing_option.id: pricing_option for pricing_option in existing}
+    by_name = {pricing_option.name: pricing_option for pricing_option in existing}
+    keep, to_create, links_by_option = set(), [], []
+
+    for pricing_data in pricing_options_data:
+        values = {
+            'name': pricing_data['name'],
+            'discount': pricing_data.get('discount', 0),
+            'base_price': pricing_data.get('base_price', 0),
+        }
+        pricing_option = by_id.get(pricing_data.get('id')) or by_name.get(pricing_data['name'])
+        if pricing_option is not None and pricing_option.id not in keep:
+            keep.add(pricing_option.id)
+            writer.update(pricing_option, _set_changed(pricing_option, values))
+        else:
+            pricing_option = PricingOption(service=service, **values)
+            to_create.append(pricing_option)
+
+        selected = {}
+        for selected_feature in pricing_data.get('selectedFeatures') or pricing_data.get('selected_features') or []:
+            feature = feature_mapping.get(selected_feature['id'])
+            if feature is not None:
+                selected[feature] = selected_feature['is_included']
+        links_by_option.append((pricing_option, selected))
+
+    PricingOption.objects.filter(id__in=set(by_id) - keep).delete()
+    writer.flush_updates(PricingOption, unique_field='name')
+    PricingOption.objects.bulk_create(to_create)
+
+    stale_links, new_links = [], []
+    for pricing_option, selected in links_by_option:
+        current = {}
+        if pricing_option.id in keep:
+            current = {link.feature_id: link for link in pricing_option.selected_features.all()}
+        for feature, is_included in selected.items():
+            link = current.pop(feature.id, None)
+            if link is None:
+                new_links.append(PricingOptionFeature(
+                    pricing_option=pricing_option, feature=feature, is_included=is_included
+                ))
+            else:
+                writer.update(link, _set_changed(link, {'is_included': is_included}))
+        stale_links.extend(link.id for link in current.values())
+
+    PricingOptionFeature.objects.filter(id__in=stale_links).delete()
+    writer.flush_updates(PricingOptionFeature)
+    PricingOptionFeature.objects.bulk_create(new_links)
@@ -0,0 +1,29 @@
+from arman_backend.local_cache import LocalCache
+from data_management_app.models import GlobalSettings
+
+
+GLOBAL_SETTINGS_CACHE_TTL = 300
+
+_settings_cache = LocalCache('global-settings', ttl=GLOBAL_SETTINGS_CACHE_TTL)
+
+
+def get_global_settings():
+    """
+    The GlobalSettings singleton from the process-local cache. Treat it as read-only,
+    writes should go through GlobalSettings.load() so the cache is invalidated on save.
+    """
+    return _settings_cache.get('singleton', GlobalSettings.load)
+
+
+def invalidate_global_settings():
+    _settings_cache.invalidate('singleton')
+
+
+def resolve_global_settings(context):
+    """
+    The singleton for one response: stored in the serializer context so every
+    serializer of the response shares a single lookup
+    """
+    if 'global_settings' not in context:
+        context['global_settings'] = get_global_settings()
+    return context['global_settings']
@@ -1,25 +1,53 @@
 import requests
-from accounts.models import GHLAuthCredentials
-from accounts.utils import fetch_contacts_locations
-from data_management_app.models import Contact, Address
+from accounts.credentials import get_credentials
+from accounts.utils import fetch_contacts_locations, get_location_custom_fields, sync_contact_addresses
+from data_management_app.models import Contact, Address, phone_lookup_fields
+from data_management_app import typeahead
 
 def create_or_update_contact(data):
+    """
+    Upsert a contact from a ContactCreate/ContactUpdate webhook body.
+    The body already carries the contact fields, tags, custom fields and address,
+    so GHL is only called again when the custom fields are missing from it.
+    """
     contact_id = data.get("id")
+    location_id = data.get("locationId")
+    defaults = {
+        "first_name": data.get("firstName"),
+        "last_name": data.get("lastName"),
+        "email": data.get("email"),
+        "phone": data.get("phone"),
+        "dnd": data.get("dnd", False),
+        "country": data.get("country"),
+        "date_added": data.get("dateAdded"),
+        "location_id": location_id,
+        **phone_lookup_fields(data.get("phone")),
+    }
+    if "tags" in data:
+        defaults["tags"] = data.get("tags") or []
+    if "customFields" in data:
+        defaults["custom_fields"] = data.get("customFields") or []
+
     contact, created = Contact.objects.update_or_create(
         contact_id=contact_id,
-        defaults={
-            "first_name": data.get("firstName"),
-            "last_name": data.get("lastName"),
-            "email": data.get("email"),
-            "phone": data.get("phone"),
-            "dnd": data.get("dnd", False),
-            "country": data.get("country"),
-            "date_added": data.get("dateAdded"),
-            "location_id": data.get("locationId"),
-        }
+        defaults=defaults
     )
-    cred = GHLAuthCredentials.objects.first()
-    fetch_contacts_locations([data], data.get("locationId"), cred.access_token)
+    typeahead.contact_saved(contact)
+
+    custom_fields = data.get("customFields")
+    needs_ghl = "customFields" not in data or any(cf.get("value") for cf in custom_fields or [])
+    cred = get_credentials(location_id) if needs_ghl else None
+    if needs_ghl and not cred:
+        # Location not connected: sync what the body carries, GHL can't be asked for the rest
+        print(f"No GHL credentials for location {location_id}, contact {contact_id} synced from the webhook only")
+        sync_contact_addresses(contact_id, data, {})
+    elif "customFields" not in data:
+        fetch_contacts_locations([data], location_id, cred.access_token)
+    else:
+        location_custom_fields = {}
+        if cred:
+            location_custom_fields = get_location_custom_fields(location_id, cred.access_token)
+        sync_contact_addresses(contact_id, data, location_custom_fields)
     print("Contact created/updated:", contact_id)
 
 def delete_contact(data):
@@ -28,7 +56,8 @@ def delete_contact(data):
         contact = Contact.objects.get(contact_id=contact_id)
         # Delete all addresses related to this contact
         Address.objects.filter(contact=contact).delete()
+        typeahead.contact_deleted(contact.location_id, contact.id)
         contact.delete()
         print("Contact and related addresses deleted:", contact_id)
     except Contact.DoesNotExist:
-        print("Contact not found for deletion:", contact_id)
\ No newline at end of file
+        print("Contact not found for deletion:", contact_id)
@@ -0,0 +1,85 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from data_management_app.models import Contact
+from data_management_app.search import search_contacts
+
+
+SYLLABLES = ['ka', 'ri', 'mo', 'len', 'sa', 'dor', 'vi', 'tan', 'el', 'bru', 'ne', 'sho', 'pa', 'lin', 'gar', 'to']
+
+
+def make_name():
+    return ''.join(random.choice(SYLLABLES) for _ in range(random.randint(2, 4)))
+
+
+class Command(BaseCommand):
+    help = "Time ContactSearchView queries against a synthetic contact table (rolled back afterwards)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--contacts', type=int, default=100000, help="Synthetic contacts to insert")
+        parser.add_argument('--runs', type=int, default=50, help="Executions per search")
+        parser.add_argument('--page-size', type=int, default=10)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.seed(options['contacts'])
+            sample = Contact.objects.filter(contact_id='bench-0').get()
+            searches = [
+                ('prefix', sample.first_name[:3]),
+                ('prefix', sample.first_name),
+                ('prefix', f"{sample.first_name} {sample.last_name[:3]}"),
+                ('prefix', sample.email),
+                ('contains', sample.last_name[1:5]),
+                ('contains', sample.email.split('@')[0][2:]),
+            ]
+            for mode, query in searches:
+                self.run(mode, query, options['runs'], options['page_size'])
+            transaction.set_rollback(True)
+
+    def seed(self, count):
+        self.stdout.write(f"Inserting {count} contacts...")
+        now = timezone.now()
+        batch = []
+        for i in range(count):
+            first = make_name()
+            last = make_name()
+            batch.append(Contact(
+                contact_id=f"bench-{i}",
+                first_name=first,
+                last_name=last,
+                email=f"{first}.{last}{i}@example.com",
+                phone=f"+1{random.randint(2000000000, 9999999999)}",
+                location_id='bench-location',
+                date_added=now,
+            ))
+            if len(batch) == 5000:
+                Contact.objects.bulk_create(batch)
+                batch = []
+        Contact.objects.bulk_create(batch)
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE "{Contact._meta.db_table}"')
+
+    def run(self, mode, query, runs, page_size):
+        qs = search_contacts(Contact.objects.defer('search_vector', 'search_text'), query, mode)
+        page_timings = []
+        count_timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            list(qs.all()[:page_size])
+            page_timings.append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            qs.count()
+            count_timings.append((time.perf_counter() - start) * 1000)
+        self.stdout.write(
+            f"{mode:<9} {query!r:<28} page {self.summary(page_timings)}   count {self.summary(count_timings)}"
+        )
+
+    def summary(self, timings):
+        timings = sorted(timings)
+        p95 = timings[max(0, int(len(timings) * 0.95) - 1)]
+        return f"median {statistics.median(timings):7.2f} ms / p95 {p95:7.2f} ms"
@@ -0,0 +1,182 @@
+import copy
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from data_management_app.models import Feature, PricingOption, PricingOptionFeature, Question, QuestionOption, Service
+from data_management_app.serializers import ServiceSerializer
+
+
+def legacy_update(instance, validated_data):
+    """
+    The delete-and-recreate ServiceSerializer.update this command compares against
+    """
+    pricing_options_data = validated_data.pop('pricingOptions', []) or validated_data.pop('pricing_options', [])
+    features_data = validated_data.pop('features', [])
+    questions_data = validated_data.pop('questions', [])
+
+    with transaction.atomic():
+        instance.name = validated_data.get('name', instance.name)
+        instance.description = validated_data.get('description', instance.description)
+        instance.save()
+
+        instance.features.all().delete()
+        instance.pricing_options.all().delete()
+        instance.questions.all().delete()
+
+        feature_mapping = {}
+        for feature_data in features_data:
+            frontend_id = feature_data.pop('id', None)
+            feature = Feature.objects.create(
+                service=instance,
+                name=feature_data['name'],
+                description=feature_data.get('description', '')
+            )
+            if frontend_id:
+                feature_mapping[frontend_id] = feature
+
+        for question_data in questions_data:
+            options_data = question_data.pop('options', [])
+            question = Question.objects.create(
+                service=instance,
+                text=question_data['text'],
+                type=question_data['type'],
+                unit_price=question_data.get('unit_price', 0),
+                is_required=question_data.get('is_required', False),
+                order=question_data.get('order', 0)
+            )
+            for i, option_value in enumerate(options_data):
+                key, value = list(option_value.items())[0]
+                QuestionOption.objects.create(question=question, value=value, label=key, order=i)
+
+        for pricing_data in pricing_options_data:
+            selected_features_data = (
+                pricing_data.pop('selectedFeatures', []) or
+                pricing_data.pop('selected_features', [])
+            )
+            pricing_option = PricingOption.objects.create(
+                service=instance,
+                name=pricing_data['name'],
+                discount=pricing_data.get('discount', 0),
+                base_price=pricing_data.get('base_price', 0),
+            )
+            for selected_feature in selected_features_data:
+                feature_id = selected_feature['id']
+                if feature_id in feature_mapping:
+                    PricingOptionFeature.objects.create(
+                        pricing_option=pricing_option,
+                        feature=feature_mapping[feature_id],
+                        is_included=selected_feature['is_included']
+                    )
+    return instance
+
+
+def rename_feature(payload):
+    payload['features'][0]['name'] += ' (renamed)'
+
+
+def change_price(payload):
+    payload['pricingOptions'][0]['base_price'] = '99.00'
+
+
+def toggle_feature(payload):
+    selected = payload['pricingOptions'][1]['selectedFeatures'][0]
+    selected['is_included'] = not selected['is_included']
+
+
+def add_question(payload):
+    payload['questions'].append({'text': 'New question', 'type': 'choice', 'options': [{'Yes': '1'}, {'No': '0'}]})
+
+
+def remove_feature(payload):
+    removed = payload['features'].pop()
+    for pricing_option in payload['pricingOptions']:
+        pricing_option['selectedFeatures'] = [
+            selected for selected in pricing_option['selectedFeatures'] if selected['id'] != removed['id']
+        ]
+
+
+SCENARIOS = [
+    ('no change', lambda payload: None),
+    ('rename feature', rename_feature),
+    ('change price', change_price),
+    ('toggle feature', toggle_feature),
+    ('add question', add_question),
+    ('remove feature', remove_feature),
+]
+
+
+class Command(BaseCommand):
+    help = "Compare the writes of the diff-based ServiceSerializer.update with the legacy delete-and-recreate (rolled back)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--features', type=int, default=12)
+        parser.add_argument('--pricing-options', type=int, default=4)
+        parser.add_argument('--questions', type=int, default=8)
+        parser.add_argument('--options', type=int, default=4, help="Options per question")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            service = self.seed(options)
+            payload = dict(ServiceSerializer(service).data)
+            for name, edit in SCENARIOS:
+                data = copy.deepcopy(payload)
+                edit(data)
+                legacy = self.measure(service, data, legacy=True)
+                diff = self.measure(service, data, legacy=False)
+                self.stdout.write(f"{name:<15} legacy {legacy}   diff {diff}")
+            transaction.set_rollback(True)
+
+    def seed(self, options):
+        data = {
+            'name': 'Benchmark service',
+            'description': 'Synthetic service',
+            'features': [
+                {'id': i, 'name': f'Feature {i}', 'description': 'Included work'} for i in range(1, options['features'] + 1)
+            ],
+            'questions': [
+                {
+                    'text': f'Question {i}', 'type': 'choice', 'order': i,
+                    'options': [{f'Option {j}': str(j)} for j in range(options['options'])],
+                }
+                for i in range(options['questions'])
+            ],
+            'pricingOptions': [
+                {
+                    'name': f'Plan {i}', 'discount': 5 * i, 'base_price': 100 + 50 * i,
+                    'selectedFeatures': [
+                        {'id': j, 'is_included': j <= i * 3} for j in range(1, options['features'] + 1)
+                    ],
+                }
+                for i in range(options['pricing_options'])
+            ],
+        }
+        serializer = ServiceSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.save()
+
+    def measure(self, service, data, legacy):
+        savepoint = transaction.savepoint()
+        serializer = ServiceSerializer(Service.objects.get(pk=service.pk), data=copy.deepcopy(data))
+        serializer.is_valid(raise_exception=True)
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            if legacy:
+                legacy_update(serializer.instance, serializer.validated_data)
+            else:
+                serializer.save()
+            elapsed = (time.perf_counter() - start) * 1000
+        transaction.savepoint_rollback(savepoint)
+
+        counts = {'INSERT': 0, 'UPDATE': 0, 'DELETE': 0}
+        for query in queries.captured_queries:
+            verb = query['sql'].split(' ', 1)[0].upper()
+            if verb in counts:
+                counts[verb] += 1
+        writes = sum(counts.values())
+        return (
+            f"{writes:4d} writes (ins {counts['INSERT']:3d} / upd {counts['UPDATE']:2d} / del {counts['DELETE']:2d}) "
+            f"{len(queries.captured_queries):4d} queries {elapsed:7.1f} ms"
+        )
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from data_management_app.models import PlanFeature, PurChasedServiceFeature
+
+
+class Command(BaseCommand):
+    help = (
+        "Collapse the duplicate PurChasedServiceFeature rows of each purchased service or catalog "
+        "snapshot (same name and description) into one and point their PlanFeature rows at it"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Report what would be reclaimed without changing anything")
+
+    def handle(self, *args, **options):
+        tables = {
+            'feature': PurChasedServiceFeature._meta.db_table,
+            'plan_feature': PlanFeature._meta.db_table,
+        }
+        # Every feature row mapped to the lowest id of its duplicate group
+        duplicates = f"""SELECT id, MIN(id) OVER (PARTITION BY purchased_service_id, snapshot_id, name, description) AS keep_id
+            FROM {tables['feature']}"""
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f"""SELECT COUNT(*), COALESCE(SUM(pg_column_size(feature.*)), 0)
+                FROM {tables['feature']} feature
+                JOIN ({duplicates}) duplicate ON duplicate.id = feature.id
+                WHERE duplicate.id <> duplicate.keep_id"""
+            )
+            rows, row_bytes = cursor.fetchone()
+            cursor.execute(f"SELECT pg_total_relation_size('{tables['feature']}')")
+            table_bytes = cursor.fetchone()[0]
+
+            relinked = 0
+            if rows and not options['dry_run']:
+                cursor.execute(
+                    f"""UPDATE {tables['plan_feature']} plan_feature SET feature_id = duplicate.keep_id
+                    FROM ({duplicates}) duplicate
+                    WHERE plan_feature.feature_id = duplicate.id AND duplicate.id <> duplicate.keep_id"""
+                )
+                relinked = cursor.rowcount
+                cursor.execute(
+                    f"""DELETE FROM {tables['feature']} feature
+                    USING ({duplicates}) duplicate
+                    WHERE duplicate.id = feature.id AND duplicate.id <> duplicate.keep_id"""
+                )
+
+        verb = "Would remove" if options['dry_run'] else "Removed"
+        self.stdout.write(
+            f"{verb} {rows} duplicate feature rows ({row_bytes / 1024:.1f} KiB of row data, "
+            f"table is {table_bytes / 1024:.1f} KiB with indexes); relinked {relinked} plan features"
+        )
+        if rows and not options['dry_run']:
+            self.stdout.write(f"Run VACUUM on {tables['feature']} to return the space to the table")
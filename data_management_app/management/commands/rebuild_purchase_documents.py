@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from data_management_app.models import Purchase
+from data_management_app.purchase_documents import save_purchase_document
+
+
+class Command(BaseCommand):
+    help = "Re-render the PurchaseDocument of every purchase (or of the given ids) from the normalized tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument('purchase_ids', nargs='*', type=int)
+        parser.add_argument('--missing', action='store_true', help="Only purchases that have no document yet")
+
+    def handle(self, *args, **options):
+        purchases = Purchase.objects.order_by('id')
+        if options['purchase_ids']:
+            purchases = purchases.filter(id__in=options['purchase_ids'])
+        if options['missing']:
+            purchases = purchases.filter(document__isnull=True)
+
+        rebuilt = 0
+        for purchase in purchases.iterator(chunk_size=500):
+            # Lock the purchase so a concurrent edit doesn't interleave with the re-render
+            with transaction.atomic():
+                save_purchase_document(Purchase.objects.select_for_update().get(pk=purchase.pk), changed=False)
+            rebuilt += 1
+            if rebuilt % 500 == 0:
+                self.stdout.write(f"{rebuilt} documents rebuilt")
+        self.stdout.write(f"Rebuilt {rebuilt} purchase documents")
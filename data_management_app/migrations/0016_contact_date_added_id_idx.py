@@ -0,0 +1,32 @@
+# Generated by Django 5.2.1 on 2026-10-19 11:01
+
+import datetime
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("data_management_app", "0015_contact_search_documents"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="contact",
+            index=models.Index(
+                models.OrderBy(
+                    django.db.models.functions.comparison.Coalesce(
+                        "date_added",
+                        models.Value(
+                            datetime.datetime(
+                                1970, 1, 1, 0, 0, tzinfo=datetime.timezone.utc
+                            )
+                        ),
+                    ),
+                    descending=True,
+                ),
+                models.OrderBy(models.F("id"), descending=True),
+                name="contact_date_added_id_idx",
+            ),
+        ),
+    ]
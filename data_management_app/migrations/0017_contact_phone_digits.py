@@ -0,0 +1,64 @@
+# Generated by Django 5.2.1 on 2026-10-19 11:03
+
+import re
+
+from django.db import migrations, models
+
+
+def phone_lookup_fields(phone):
+    # Frozen copy of models.normalize_phone as of this migration
+    digits = re.sub(r"\D", "", phone)
+    if phone.strip().startswith("00"):
+        digits = digits[2:]
+    digits = digits or None
+    return {
+        "phone_digits": digits,
+        "phone_digits_reversed": digits[::-1] if digits else None,
+    }
+
+
+def backfill_phone_digits(apps, schema_editor):
+    Contact = apps.get_model("data_management_app", "Contact")
+    batch = []
+    for contact in Contact.objects.exclude(phone__isnull=True).exclude(phone="").only("id", "phone").iterator():
+        for field, value in phone_lookup_fields(contact.phone).items():
+            setattr(contact, field, value)
+        batch.append(contact)
+        if len(batch) == 1000:
+            Contact.objects.bulk_update(batch, ["phone_digits", "phone_digits_reversed"])
+            batch = []
+    Contact.objects.bulk_update(batch, ["phone_digits", "phone_digits_reversed"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("data_management_app", "0016_contact_date_added_id_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="contact",
+            name="phone_digits",
+            field=models.CharField(blank=True, max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name="contact",
+            name="phone_digits_reversed",
+            field=models.CharField(blank=True, max_length=20, null=True),
+        ),
+        migrations.RunPython(backfill_phone_digits, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="contact",
+            index=models.Index(
+                fields=["phone_digits"], name="contact_phone_digits_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="contact",
+            index=models.Index(
+                fields=["phone_digits_reversed"],
+                name="contact_phone_suffix_idx",
+                opclasses=["varchar_pattern_ops"],
+            ),
+        ),
+    ]
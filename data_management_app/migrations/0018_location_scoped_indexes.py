@@ -0,0 +1,40 @@
+# Generated by Django 5.2.1 on 2026-10-19 11:04
+
+import datetime
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("data_management_app", "0017_contact_phone_digits"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="contact",
+            index=models.Index(
+                models.F("location_id"),
+                models.OrderBy(
+                    django.db.models.functions.comparison.Coalesce(
+                        "date_added",
+                        models.Value(
+                            datetime.datetime(
+                                1970, 1, 1, 0, 0, tzinfo=datetime.timezone.utc
+                            )
+                        ),
+                    ),
+                    descending=True,
+                ),
+                models.OrderBy(models.F("id"), descending=True),
+                name="contact_loc_date_added_id_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="contact",
+            index=models.Index(
+                fields=["location_id", "contact_id"],
+                name="contact_location_contact_idx",
+            ),
+        ),
+    ]
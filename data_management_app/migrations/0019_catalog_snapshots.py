@@ -0,0 +1,75 @@
+# Generated by Django 5.2.1 on 2026-10-19 11:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("data_management_app", "0018_location_scoped_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CatalogSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("digest", models.CharField(max_length=64, unique=True)),
+                ("service_name", models.CharField(max_length=200)),
+                ("description", models.TextField(blank=True, null=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name="purchasedservicefeature",
+            name="purchased_service",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="service_feature",
+                to="data_management_app.purchasedservice",
+            ),
+        ),
+        migrations.AddField(
+            model_name="purchasedservice",
+            name="snapshot",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="purchased_services",
+                to="data_management_app.catalogsnapshot",
+            ),
+        ),
+        migrations.AddField(
+            model_name="purchasedservicefeature",
+            name="snapshot",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="features",
+                to="data_management_app.catalogsnapshot",
+            ),
+        ),
+        migrations.AddField(
+            model_name="purchasedserviceplan",
+            name="snapshot",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="plans",
+                to="data_management_app.catalogsnapshot",
+            ),
+        ),
+    ]
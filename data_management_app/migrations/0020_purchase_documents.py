@@ -0,0 +1,34 @@
+# Generated by Django 5.2.1 on 2026-10-19 11:18
+
+import django.db.models.deletion
+import rest_framework.utils.encoders
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("data_management_app", "0019_catalog_snapshots"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PurchaseDocument",
+            fields=[
+                (
+                    "purchase",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="document",
+                        serialize=False,
+                        to="data_management_app.purchase",
+                    ),
+                ),
+                (
+                    "payload",
+                    models.JSONField(encoder=rest_framework.utils.encoders.JSONEncoder),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
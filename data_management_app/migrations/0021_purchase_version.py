@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-19 11:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("data_management_app", "0020_purchase_documents"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="purchase",
+            name="version",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
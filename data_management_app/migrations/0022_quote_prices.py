@@ -0,0 +1,26 @@
+# Generated by Django 5.2.1 on 2026-10-19 11:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("data_management_app", "0021_purchase_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="purchasedservice",
+            name="answers_price",
+            field=models.DecimalField(
+                blank=True, decimal_places=2, max_digits=10, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="purchasedserviceplan",
+            name="price",
+            field=models.DecimalField(
+                blank=True, decimal_places=2, max_digits=10, null=True
+            ),
+        ),
+    ]
@@ -1,7 +1,13 @@
 from django.db import models
+from django.db.models.functions import Coalesce, Concat, Lower
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.core.validators import MinValueValidator, MaxValueValidator
+import re
 import uuid
+from datetime import datetime, timezone as dt_timezone
 from django.core.exceptions import ValidationError
+from rest_framework.utils.encoders import JSONEncoder
 
 
 class WebhookLog(models.Model):
@@ -10,9 +16,76 @@ class WebhookLog(models.Model):
 
     def __str__(self):
         return f"{self.webhook_id} : {self.received_at}"
-    
 
 
+class InvoiceJob(models.Model):
+    """
+    Invoice creation request received from the GHL workflow webhook,
+    processed asynchronously by a Celery worker
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSING = 'processing'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_PROCESSING, 'Processing'),
+        (STATUS_COMPLETED, 'Completed'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    idempotency_key = models.CharField(max_length=255, unique=True)
+    location_id = models.CharField(max_length=255, db_index=True)
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    product_id = models.CharField(max_length=255, null=True, blank=True)
+    invoice_id = models.CharField(max_length=255, null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"InvoiceJob #{self.id} ({self.status})"
+
+
+
+
+# Contacts without date_added sort after every dated contact
+DATE_ADDED_FLOOR = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def contact_sort_key():
+    """Newest-first ordering key of contacts, used by keyset pagination"""
+    return Coalesce('date_added', models.Value(DATE_ADDED_FLOOR))
+
+
+def normalize_phone(phone):
+    """
+    Digits of a phone number as GHL stores it (E.164 without the '+'),
+    so '+1 (555) 010-2030' and '+15550102030' compare equal
+    """
+    if not phone:
+        return None
+    digits = re.sub(r'\D', '', phone)
+    if phone.strip().startswith('00'):
+        digits = digits[2:]
+    return digits or None
+
+
+def phone_lookup_fields(phone):
+    """Values of the normalized phone columns for a raw phone string"""
+    digits = normalize_phone(phone)
+    return {
+        'phone_digits': digits,
+        'phone_digits_reversed': digits[::-1] if digits else None,
+    }
+
+
+class ContactQuerySet(models.QuerySet):
+    def for_location(self, location_id):
+        return self.filter(location_id=location_id)
+
 
 class Contact(models.Model):
     contact_id = models.CharField(max_length=100, unique=True)
@@ -28,6 +101,45 @@ class Contact(models.Model):
     location_id = models.CharField(max_length=100)
     timestamp = models.DateTimeField(blank=True, null=True)
 
+    # Normalized copies of phone for exact and ends-with lookups, set wherever phone is written
+    phone_digits = models.CharField(max_length=20, blank=True, null=True)
+    phone_digits_reversed = models.CharField(max_length=20, blank=True, null=True)
+
+    objects = ContactQuerySet.as_manager()
+
+    # Search documents kept up to date by Postgres on every write
+    search_vector = models.GeneratedField(
+        expression=SearchVector('first_name', 'last_name', 'email', 'phone', 'country', config='simple'),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+    search_text = models.GeneratedField(
+        expression=Lower(Concat(
+            'first_name', models.Value(' '), 'last_name', models.Value(' '),
+            'email', models.Value(' '), 'phone', models.Value(' '), 'country',
+            output_field=models.TextField()
+        )),
+        output_field=models.TextField(),
+        db_persist=True,
+    )
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='contact_search_vector_idx'),
+            GinIndex(fields=['search_text'], name='contact_search_text_trgm_idx', opclasses=['gin_trgm_ops']),
+            models.Index(contact_sort_key().desc(), models.F('id').desc(), name='contact_date_added_id_idx'),
+            # Per-location reads: newest-first listing and lookups by GHL id
+            models.Index(
+                models.F('location_id'), contact_sort_key().desc(), models.F('id').desc(),
+                name='contact_loc_date_added_id_idx'
+            ),
+            models.Index(fields=['location_id', 'contact_id'], name='contact_location_contact_idx'),
+            models.Index(fields=['phone_digits'], name='contact_phone_digits_idx'),
+            models.Index(
+                fields=['phone_digits_reversed'], name='contact_phone_suffix_idx', opclasses=['varchar_pattern_ops']
+            ),
+        ]
+
     def __str__(self):
         return f"{self.first_name} {self.last_name} ({self.email})"
     
@@ -262,6 +374,11 @@ class QuestionOption(models.Model):
 
 
 
+class AddressQuerySet(models.QuerySet):
+    def for_location(self, location_id):
+        return self.filter(contact__location_id=location_id)
+
+
 class Address(models.Model):
     PROPERTY_TYPE_CHOICES = [
         ('residential', 'Residential'),
@@ -280,41 +397,120 @@ class Address(models.Model):
     property_sqft = models.PositiveIntegerField(blank=True, null=True)
     property_type = models.CharField(max_length=20, choices=PROPERTY_TYPE_CHOICES, blank=True, null=True)
 
+    objects = AddressQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.street_address}, {self.city}, {self.state}"
 
 
 
 
+class PurchaseQuerySet(models.QuerySet):
+    def for_location(self, location_id):
+        return self.filter(contact__location_id=location_id)
+
+    def with_details(self):
+        """
+        Everything PurchaseDetailSerializer reads, in a fixed number of queries
+        whatever the size of the quote
+        """
+        plans = PurchasedServicePlan.objects.order_by('id').prefetch_related(
+            models.Prefetch('plan_feat', queryset=PlanFeature.objects.select_related('feature').order_by('id'))
+        )
+        features = PurChasedServiceFeature.objects.order_by('id')
+        return self.select_related('contact', 'address').prefetch_related(
+            models.Prefetch('custom_products', queryset=CustomProduct.objects.order_by('id')),
+            models.Prefetch('service_plans', queryset=PurchasedService.objects.order_by('id').select_related(
+                'snapshot'
+            ).prefetch_related(
+                # Purchases saved before catalog snapshots own their plans and features
+                models.Prefetch('snapshot__plans', queryset=plans),
+                models.Prefetch('snapshot__features', queryset=features),
+                models.Prefetch('service_feature_plans', queryset=plans),
+                models.Prefetch('service_feature', queryset=features),
+                models.Prefetch('selected_plan', queryset=plans),
+                models.Prefetch('answers', queryset=QuestionsAndAnswers.objects.order_by('id').prefetch_related(
+                    models.Prefetch('questionoptionanswers_set', queryset=QuestionOptionAnswers.objects.order_by('id'))
+                )),
+            )),
+        )
+
+
 class Purchase(models.Model):
     contact = models.ForeignKey(Contact, on_delete=models.CASCADE, related_name="purchases")
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
     is_submited = models.BooleanField(default=False)
     signature = models.CharField(max_length=200, null=True, blank=True)
     address = models.ForeignKey(Address, on_delete=models.CASCADE, null=True, blank=True, related_name="purchased_address")
+    # Moves with every change to the quote so editors can patch local state and detect conflicts
+    version = models.PositiveIntegerField(default=0)
 
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = PurchaseQuerySet.as_manager()
+
     def __str__(self):
         return f"Purchase #{self.id} by Contact {self.contact.contact_id}"
 
+class CatalogSnapshot(models.Model):
+    """
+    Immutable copy of a service's plans and features as quoted, identified by
+    the hash of its content and shared by every purchased service that saw the
+    same catalog state
+    """
+    digest = models.CharField(max_length=64, unique=True)
+    service_name = models.CharField(max_length=200)
+    description = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.service_name} ({self.digest[:12]})"
+
+class PurchaseDocument(models.Model):
+    """
+    The rendered review payload of a purchase, rewritten in the same transaction
+    as every change to the purchase. Contact, address and minimum price are
+    added when it is read since they change outside the purchase.
+    """
+    purchase = models.OneToOneField(Purchase, on_delete=models.CASCADE, primary_key=True, related_name='document')
+    payload = models.JSONField(encoder=JSONEncoder)
+    updated_at = models.DateTimeField(auto_now=True)
+
 class PurchasedService(models.Model):
     purchase = models.ForeignKey(Purchase, on_delete=models.CASCADE, related_name="service_plans")
 
     # Snapshot of selected Service
     service_name = models.CharField(max_length=200)
     description = models.TextField(blank=True, null=True)
+    # Shared plans and features; purchases saved before snapshots own their rows instead
+    snapshot = models.ForeignKey(CatalogSnapshot, on_delete=models.PROTECT, related_name='purchased_services', null=True, blank=True)
 
     selected_plan = models.ForeignKey('data_management_app.PurchasedServicePlan', on_delete=models.SET_NULL, related_name='selected_service', null=True)
+    # Server-side price of the answered questions (see pricing.py), the plan price is on the plan
+    answers_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+
+    def snapshot_plans(self):
+        if self.snapshot_id:
+            return self.snapshot.plans.all()
+        return self.service_feature_plans.all()
+
+    def snapshot_features(self):
+        if self.snapshot_id:
+            return self.snapshot.features.all()
+        return self.service_feature.all()
 
 class PurchasedServicePlan(models.Model):
     purchased_service = models.ForeignKey(PurchasedService, on_delete=models.CASCADE, null=True, related_name="service_feature_plans")
+    snapshot = models.ForeignKey(CatalogSnapshot, on_delete=models.CASCADE, null=True, blank=True, related_name="plans")
 
     name = models.CharField(max_length=100, null=True, blank=True)
     discount = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
+    # Discounted price of the plan when quoted
+    price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     
 class PurChasedServiceFeature(models.Model):
-    purchased_service = models.ForeignKey(PurchasedService, on_delete=models.CASCADE, related_name="service_feature")
+    purchased_service = models.ForeignKey(PurchasedService, on_delete=models.CASCADE, null=True, blank=True, related_name="service_feature")
+    snapshot = models.ForeignKey(CatalogSnapshot, on_delete=models.CASCADE, null=True, blank=True, related_name="features")
 
     name = models.CharField(max_length=200)
     description = models.TextField(blank=True, null=True)
@@ -1,6 +1,173 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import json
+from datetime import datetime
+
+from django.db.models import BooleanField, F, FloatField, Func, Value
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .models import DATE_ADDED_FLOOR, contact_sort_key
+
 
 class ContactPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = 'page_size'
-    max_page_size = 100
\ No newline at end of file
+    max_page_size = 100
+
+
+class RowCompare(Func):
+    """
+    ``(a, b) < (x, y)`` as one row comparison so Postgres uses it as an index condition
+    """
+    output_field = BooleanField()
+
+    def __init__(self, lhs, operator, rhs):
+        self.operator = operator
+        self.row_length = len(lhs)
+        super().__init__(*lhs, *rhs)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        parts, params = [], []
+        for expression in self.get_source_expressions():
+            sql, expression_params = compiler.compile(expression)
+            parts.append(sql)
+            params.extend(expression_params)
+        lhs, rhs = parts[:self.row_length], parts[self.row_length:]
+        return f"({', '.join(lhs)}) {self.operator} ({', '.join(rhs)})", params
+
+
+class ContactCursorPagination(BasePagination):
+    """
+    Keyset pagination over (date_added, id), newest first.
+
+    Every page is an index range scan on contact_date_added_id_idx, so deep
+    pages cost the same as the first one and no COUNT(*) is run. Pass
+    ``count=approximate`` to get the planner's row estimate for the filter.
+    Querysets ranked by search_contacts are paged over (rank, date_added, id),
+    best match first, with the rank carried in the cursor.
+    """
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.approximate_count = None
+        if request.query_params.get('count') == 'approximate':
+            self.approximate_count = self.estimate_count(queryset)
+
+        self.ranked = 'rank' in queryset.query.annotations
+        keys = ['rank', 'sort_key', 'id'] if self.ranked else ['sort_key', 'id']
+        queryset = queryset.alias(sort_key=contact_sort_key())
+        cursor = self.decode_cursor(request)
+        reverse = bool(cursor and cursor['reverse'])
+
+        if cursor:
+            operator = '>' if reverse else '<'
+            queryset = queryset.filter(RowCompare(
+                [F(key) for key in keys], operator, [self.cursor_value(cursor, key) for key in keys]
+            ))
+        if reverse:
+            queryset = queryset.order_by(*(F(key).asc() for key in keys))
+        else:
+            queryset = queryset.order_by(*(F(key).desc() for key in keys))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        self.next_position = self.previous_position = None
+        if results:
+            if has_more or reverse:
+                self.next_position = results[-1]
+            if (has_more and reverse) or (cursor and not reverse):
+                self.previous_position = results[0]
+        return results
+
+    def get_paginated_response(self, data):
+        payload = {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+        if self.approximate_count is not None:
+            payload['approximate_count'] = self.approximate_count
+        return Response(payload)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'approximate_count': {'type': 'integer'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position, reverse=False)
+
+    def get_previous_link(self):
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(self.previous_position, reverse=True)
+
+    def encode_cursor(self, contact, reverse):
+        sort_key = contact.date_added or DATE_ADDED_FLOOR
+        position = {
+            'k': sort_key.isoformat(),
+            'i': contact.id,
+            'r': reverse,
+        }
+        if self.ranked:
+            position['s'] = contact.rank
+        token = base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            data = json.loads(base64.urlsafe_b64decode(token.encode()))
+            cursor = {
+                'sort_key': datetime.fromisoformat(data['k']),
+                'id': int(data['i']),
+                'reverse': bool(data.get('r')),
+            }
+            if self.ranked:
+                cursor['rank'] = float(data['s'])
+            return cursor
+        except (TypeError, ValueError, KeyError):
+            raise NotFound('Invalid cursor')
+
+    def cursor_value(self, cursor, key):
+        if key == 'rank':
+            # ts_rank is a real; compare in real so the rounded JSON value finds its ties again
+            return Func(Value(cursor[key]), template='%(expressions)s::real', output_field=FloatField())
+        return Value(cursor[key])
+
+    def estimate_count(self, queryset):
+        try:
+            plan = json.loads(queryset.order_by().explain(format='json'))
+            return int(plan[0]['Plan']['Plan Rows'])
+        except Exception:
+            return None
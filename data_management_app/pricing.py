@@ -0,0 +1,181 @@
+"""
+Server-side quote pricing.
+
+A service's pricing inputs (plan prices after discount, question unit prices
+and option surcharges) are compiled once into a ``ServiceRules`` and kept in
+process memory for the current catalog version, so pricing a quote is plain
+Decimal arithmetic on data already loaded by PurchaseLookups.
+
+A service line costs its selected plan plus its answers:
+
+* ``boolean`` questions add their unit price when answered yes
+* ``choice`` / ``multiple_choice`` options add ``qty * (unit price + option price)``
+* ``extra_choice`` options are picked, not counted: each adds ``unit price + option price``
+
+The quote total is the sum of the lines and the custom products, raised to
+``GlobalSettings.minimum_price`` when the quote has services.
+"""
+import logging
+import threading
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal('0.01')
+
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+
+def to_cents(amount):
+    return Decimal(amount).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+class ServiceRules:
+    """
+    Precomputed prices of one service: ``plans[plan id]`` is the discounted plan
+    price, ``questions[question id]`` is ``(type, unit price, {label: option price})``
+    with casefolded labels
+    """
+
+    def __init__(self, plans, questions):
+        self.plans = plans
+        self.questions = questions
+
+    def answers_price(self, questions_data):
+        total = Decimal('0')
+        for q in questions_data:
+            rule = self.questions.get(q['id'])
+            if rule is None:
+                continue
+            question_type, unit_price, option_prices = rule
+            if question_type == 'boolean':
+                if q['ans']:
+                    total += unit_price
+                continue
+            for label, qty in q.get('options', {}).items():
+                line = unit_price + option_prices.get(label.casefold(), Decimal('0'))
+                total += line if question_type == 'extra_choice' else line * qty
+        return to_cents(total)
+
+
+def compile_service(plans, questions):
+    """
+    ServiceRules from PricingOption and Question rows (options prefetched)
+    """
+    question_rules = {}
+    for question in questions:
+        option_prices = {}
+        for option in question.options.all():
+            option_prices.setdefault(option.label.casefold(), option.additional_price)
+        question_rules[question.id] = (question.type, question.unit_price, option_prices)
+    return ServiceRules({plan.id: to_cents(plan.discounted_price) for plan in plans}, question_rules)
+
+
+def service_rules(service_id, lookups):
+    """
+    The compiled rules of a service for the catalog version ``lookups`` was
+    loaded at. Whatever this process hasn't compiled for that version yet is
+    compiled from the rows of ``lookups`` (which only holds the questions a
+    payload answers, so the question rules grow as quotes come in); a plan
+    missing from the rules recompiles the plans.
+    """
+    version = lookups.catalog_version
+    cached = _compiled.get(service_id)
+    rules = cached[1] if cached and cached[0] == version else None
+    missing = [
+        question for question in lookups.questions.values()
+        if question.service_id == service_id and (rules is None or question.id not in rules.questions)
+    ]
+    plans = lookups.plans_by_service[service_id]
+    if rules is not None and not missing and all(plan.id in rules.plans for plan in plans):
+        return rules
+
+    compiled = compile_service(plans, missing)
+    if rules is not None:
+        compiled.questions = {**rules.questions, **compiled.questions}
+    with _compiled_lock:
+        _compiled[service_id] = (version, compiled)
+    return compiled
+
+
+def price_services(services_data, lookups):
+    """
+    ``(plan price, answers price)`` of every service of a purchase payload, in order.
+    The plan price is None when the plan doesn't belong to the service.
+    """
+    prices = []
+    for service in services_data:
+        rules = service_rules(service['id'], lookups)
+        prices.append((rules.plans.get(service['price_plan']), rules.answers_price(service.get('questions', []))))
+    return prices
+
+
+def quote_total(line_prices, custom_products, minimum_price):
+    """
+    Total of a quote from its ``(plan price, answers price)`` lines, or None
+    when a line can't be priced (purchases saved before prices were recorded)
+    """
+    total = Decimal('0')
+    for plan_price, answers_price in line_prices:
+        if plan_price is None or answers_price is None:
+            return None
+        total += plan_price + answers_price
+    total += sum((Decimal(product['price']) for product in custom_products), Decimal('0'))
+    if line_prices and minimum_price is not None:
+        total = max(total, minimum_price)
+    return to_cents(total)
+
+
+def price_purchase(purchase, minimum_price):
+    """
+    Total of a saved purchase from the prices recorded on its plans and services
+    """
+    lines = list(purchase.service_plans.values_list('selected_plan__price', 'answers_price'))
+    return quote_total(lines, purchase.custom_products.values('price'), minimum_price)
+
+
+def is_legacy_purchase(purchase):
+    """
+    True for purchases saved before prices were recorded, which can't be priced
+    """
+    return purchase.service_plans.filter(answers_price__isnull=True).exists()
+
+
+def check_total(field, client_total, priced_total, label, legacy=False):
+    """
+    The total to store: the priced one. Only ``legacy`` quotes, which can't be
+    priced, keep the client's. A client total that differs from the priced one
+    is rejected when PRICING_STRICT is set, else logged.
+    """
+    if priced_total is None:
+        if not legacy:
+            # A quote with recorded prices always prices, unless a service has no plan selected
+            raise serializers.ValidationError({field: "The quote can't be priced, every service needs a plan."})
+        if client_total is None:
+            raise serializers.ValidationError({field: "This field is required."})
+        return client_total
+    if client_total is not None and to_cents(client_total) != priced_total:
+        if settings.PRICING_STRICT:
+            raise serializers.ValidationError({field: f"Total should be {priced_total}"})
+        logger.warning("Pricing mismatch on %s: client sent %s, server priced %s", label, client_total, priced_total)
+    return priced_total
+
+
+def reprice_purchase(purchase, minimum_price, client_total=None):
+    """
+    Store the total of a saved purchase after its lines changed. Legacy
+    purchases, which can't be priced, keep the client's total or their current one.
+    """
+    legacy = is_legacy_purchase(purchase)
+    if legacy and client_total is None:
+        client_total = purchase.total_amount
+    purchase.total_amount = check_total(
+        'total_amount', client_total, price_purchase(purchase, minimum_price), f"purchase {purchase.id}", legacy=legacy
+    )
+    # Only the total: the version is moved with F() by save_purchase_document
+    purchase.save(update_fields=['total_amount'])
+    return purchase.total_amount
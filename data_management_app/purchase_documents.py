@@ -0,0 +1,139 @@
+"""
+JSON read model of the purchase review.
+
+``save_purchase_document`` renders a purchase through PurchaseDetailSerializer
+and stores the result in its PurchaseDocument; every path that changes a
+purchase calls it inside the same transaction. ``get_review`` serves the review
+from that row with one primary-key fetch (joined with the contact and address,
+which change outside the purchase and are rendered on read).
+
+In front of the documents the complete review is cached: for a day once the
+quote is submitted, since it won't change anymore, and briefly for drafts.
+Entries are dropped when the purchase, its contact or its address is written,
+and retired with the catalog version (which also moves with GlobalSettings).
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from rest_framework.renderers import JSONRenderer
+
+from .catalog import catalog_version
+from .global_settings import get_global_settings
+from .models import Purchase, PurchaseDocument
+from .serializers import ContactSerializer, PurchaseDetailSerializer
+
+# Parts of the review that don't belong to the purchase itself
+LIVE_FIELDS = ['contact', 'address', 'minimum_price']
+
+SUBMITTED_REVIEW_TTL = 60 * 60 * 24
+DRAFT_REVIEW_TTL = 60
+
+
+def review_cache_key(purchase_id):
+    return f"purchase-review:{catalog_version()}:{purchase_id}"
+
+
+def invalidate_reviews(purchase_ids):
+    """
+    Drop the cached reviews of the purchases once the current transaction commits
+    """
+    purchase_ids = list(purchase_ids)
+    if purchase_ids:
+        transaction.on_commit(lambda: cache.delete_many([review_cache_key(pk) for pk in purchase_ids]))
+
+
+def render_purchase_document(purchase):
+    # Read back with the full prefetch plan so no cached relation of the caller's instance is stale
+    purchase = Purchase.objects.with_details().get(pk=purchase.pk)
+    data = dict(PurchaseDetailSerializer(purchase).data)
+    for field in LIVE_FIELDS:
+        data.pop(field, None)
+    return data
+
+
+def save_purchase_document(purchase, changed=True):
+    """
+    Re-render the document of a purchase; call it in the transaction that changed
+    the purchase. ``changed`` moves the purchase version (not for plain rebuilds).
+    """
+    if changed:
+        # The row lock also serializes concurrent edits of the same quote
+        Purchase.objects.filter(pk=purchase.pk).update(version=F('version') + 1)
+    document, _ = PurchaseDocument.objects.update_or_create(
+        purchase=purchase, defaults={'payload': render_purchase_document(purchase)}
+    )
+    invalidate_reviews([purchase.pk])
+    return document
+
+
+def review_data(purchase, payload):
+    """
+    The PurchaseDetailSerializer payload of a purchase rebuilt from its document
+    """
+    serializer = PurchaseDetailSerializer()
+    data = {'id': payload['id']}
+    data['contact'] = ContactSerializer(purchase.contact).data
+    data['address'] = serializer.get_address(purchase)
+    data.update((key, value) for key, value in payload.items() if key != 'id')
+    data['minimum_price'] = get_global_settings().minimum_price
+    return data
+
+
+def get_review(purchase_id, location_id=None):
+    """
+    The rendered review of a purchase, from the cache or else its document.
+    Purchases without a document yet (saved before documents existed) are
+    rendered once and stored.
+
+    Returns:
+        tuple (content, etag): JSON bytes and their strong ETag
+
+    Raises:
+        Purchase.DoesNotExist
+    """
+    key = review_cache_key(purchase_id)
+    cached = cache.get(key)
+    if cached is not None:
+        cached_location_id, content, etag = cached
+        if location_id and location_id != cached_location_id:
+            raise Purchase.DoesNotExist
+        return content, etag
+
+    documents = PurchaseDocument.objects.select_related('purchase__contact', 'purchase__address')
+    if location_id:
+        documents = documents.filter(purchase__contact__location_id=location_id)
+    try:
+        document = documents.get(purchase_id=purchase_id)
+    except PurchaseDocument.DoesNotExist:
+        purchases = Purchase.objects.select_related('contact', 'address')
+        if location_id:
+            purchases = purchases.for_location(location_id)
+        purchase = purchases.get(id=purchase_id)
+        document = save_purchase_document(purchase, changed=False)
+
+    purchase = document.purchase
+    content = JSONRenderer().render(review_data(purchase, document.payload))
+    etag = f'"{hashlib.sha256(content).hexdigest()}"'
+    ttl = SUBMITTED_REVIEW_TTL if purchase.is_submited else DRAFT_REVIEW_TTL
+    cache.set(key, (purchase.contact.location_id, content, etag), ttl)
+    return content, etag
+
+
+def review_delta(document, removed_id):
+    """
+    What an editor needs to patch its copy of the review after a row was removed
+    """
+    payload = document.payload
+    return {
+        'purchase_id': payload['id'],
+        'removed_id': removed_id,
+        'version': payload['version'],
+        'totals': {
+            'total_amount': payload['total_amount'],
+            'custom_products_total': sum(product['price'] for product in payload['custom_products']),
+            'service_count': len(payload['services']),
+            'custom_product_count': len(payload['custom_products']),
+        },
+    }
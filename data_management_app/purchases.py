@@ -0,0 +1,237 @@
+import hashlib
+import json
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, Q
+from rest_framework import serializers
+
+from .catalog import catalog_version
+from .pricing import service_rules, to_cents
+from .models import (
+    Service, PricingOption, Question, CatalogSnapshot, PurchasedService, PurchasedServicePlan,
+    PurChasedServiceFeature, PlanFeature, QuestionsAndAnswers, QuestionOptionAnswers, CustomProduct
+)
+
+
+class PurchaseLookups:
+    """
+    Catalog rows referenced by the services of a purchase payload, loaded up
+    front with one query per model (plus prefetches) whatever the quote size
+    """
+
+    def __init__(self, services_data):
+        # Read before the rows: a catalog write racing the load then moves the
+        # version past what gets compiled from them, so stale rules aren't kept
+        self.catalog_version = catalog_version()
+        service_ids = {service['id'] for service in services_data}
+        plan_ids = {service['price_plan'] for service in services_data}
+        question_ids = {q['id'] for service in services_data for q in service.get('questions', [])}
+
+        self.services = Service.objects.in_bulk(service_ids)
+
+        plans = PricingOption.objects.filter(
+            Q(service_id__in=service_ids) | Q(id__in=plan_ids)
+        ).prefetch_related('selected_features__feature')
+        self.plans = {}
+        self.plans_by_service = defaultdict(list)
+        for plan in plans:
+            self.plans[plan.id] = plan
+            if plan.service_id in service_ids:
+                self.plans_by_service[plan.service_id].append(plan)
+
+        self.questions = Question.objects.prefetch_related('options').in_bulk(question_ids)
+        self.options = {}
+        for question in self.questions.values():
+            labels = {}
+            for option in question.options.all():
+                labels.setdefault(option.label.casefold(), option)
+            self.options[question.id] = labels
+
+    def validate(self, services_data):
+        """
+        Raise a ValidationError listing every service, plan, question or option
+        of the payload that doesn't exist, and every plan of another service
+        """
+        errors = []
+        for service in services_data:
+            if service['id'] not in self.services:
+                errors.append(f"Service with id {service['id']} not found")
+            if service['price_plan'] not in self.plans:
+                errors.append(f"Pricing option with id {service['price_plan']} not found")
+            elif self.plans[service['price_plan']].service_id != service['id']:
+                errors.append(f"Pricing option with id {service['price_plan']} is not offered for service {service['id']}")
+            for q in service.get('questions', []):
+                if q['id'] not in self.questions:
+                    errors.append(f"Question with id {q['id']} not found")
+                    continue
+                for key in q.get('options', {}):
+                    if key.casefold() not in self.options[q['id']]:
+                        errors.append(f"QuestionOption '{key}' not found for Question ID {q['id']}")
+        if errors:
+            raise serializers.ValidationError({'services': errors})
+
+    def option(self, question_id, label):
+        return self.options[question_id][label.casefold()]
+
+
+def snapshot_content(service_obj, plans, pricing_plan, rules):
+    """
+    The plans and features a purchased service shows, as plain data. Every plan
+    lists the features of the selected plan; features are referenced by position.
+    Plan prices come from the compiled pricing ``rules`` of the service.
+    """
+    selected_features = sorted(pricing_plan.selected_features.all(), key=lambda pof: pof.id)
+    feature_positions = {}
+    features = []
+    if plans:
+        for pof in selected_features:
+            if pof.feature_id not in feature_positions:
+                feature_positions[pof.feature_id] = len(features)
+                features.append([pof.feature.name, pof.feature.description])
+    return {
+        'service_name': service_obj.name,
+        'description': service_obj.description,
+        'features': features,
+        'plans': [
+            [
+                option.name,
+                option.discount,
+                rules.plans.get(option.id, to_cents(option.discounted_price)),
+                [[feature_positions[pof.feature_id], pof.is_included] for pof in selected_features],
+            ]
+            for option in plans
+        ],
+    }
+
+
+def snapshot_digest(content):
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def get_or_create_snapshots(contents):
+    """
+    The CatalogSnapshot of every ``{digest: content}``, creating the missing ones
+    with their plans, features and links in one bulk INSERT per model.
+
+    Returns:
+        ``{digest: (snapshot, [plan ids in plan order])}``
+    """
+    CatalogSnapshot.objects.bulk_create(
+        [
+            CatalogSnapshot(digest=digest, service_name=content['service_name'], description=content['description'])
+            for digest, content in contents.items()
+        ],
+        ignore_conflicts=True,
+    )
+    snapshots = CatalogSnapshot.objects.annotate(plan_count=Count('plans')).in_bulk(contents, field_name='digest')
+
+    # Snapshots without plans are the ones just inserted (a concurrent writer of the
+    # same digest commits its plans before our insert goes through)
+    plans, features, plan_features = [], [], []
+    for digest, snapshot in snapshots.items():
+        if snapshot.plan_count:
+            continue
+        content = contents[digest]
+        feature_objs = [
+            PurChasedServiceFeature(snapshot=snapshot, name=name, description=description)
+            for name, description in content['features']
+        ]
+        features.extend(feature_objs)
+        for name, discount, price, links in content['plans']:
+            plan = PurchasedServicePlan(snapshot=snapshot, name=name, discount=discount, price=price)
+            plans.append(plan)
+            plan_features.extend(
+                PlanFeature(purchased_service_plan=plan, feature=feature_objs[position], is_included=is_included)
+                for position, is_included in links
+            )
+    PurchasedServicePlan.objects.bulk_create(plans)
+    PurChasedServiceFeature.objects.bulk_create(features)
+    PlanFeature.objects.bulk_create(plan_features)
+
+    plan_ids = defaultdict(list)
+    for snapshot_id, plan_id in PurchasedServicePlan.objects.filter(
+        snapshot__in=snapshots.values()
+    ).order_by('id').values_list('snapshot_id', 'id'):
+        plan_ids[snapshot_id].append(plan_id)
+    return {digest: (snapshot, plan_ids[snapshot.id]) for digest, snapshot in snapshots.items()}
+
+
+def add_purchased_services(purchase, services_data, lookups):
+    """
+    Add the selected services and the answered questions to the purchase.
+
+    The plans and features are not copied per purchase: they live in a
+    CatalogSnapshot identified by the hash of their content, created the first
+    time a quote sees that catalog state and shared afterwards. Per purchase
+    only the PurchasedService rows (with the selected plan) and the answers are
+    written, one bulk INSERT per model.
+    """
+    contents = {}
+    selections = []
+    for service in services_data:
+        service_obj = lookups.services[service['id']]
+        pricing_plan = lookups.plans[service['price_plan']]
+        plans = lookups.plans_by_service[service_obj.id]
+        rules = service_rules(service_obj.id, lookups)
+        content = snapshot_content(service_obj, plans, pricing_plan, rules)
+        digest = snapshot_digest(content)
+        contents[digest] = content
+        selected = plans.index(pricing_plan) if pricing_plan in plans else None
+        answers_price = rules.answers_price(service['questions'])
+        selections.append((service, service_obj, digest, selected, answers_price))
+
+    purchased_services, answers, option_answers = [], [], []
+    with transaction.atomic():
+        snapshots = get_or_create_snapshots(contents)
+
+        for service, service_obj, digest, selected, answers_price in selections:
+            snapshot, plan_ids = snapshots[digest]
+            purchased_service_obj = PurchasedService(
+                purchase=purchase,
+                service_name=service_obj.name,
+                description=service_obj.description,
+                snapshot=snapshot,
+                selected_plan_id=plan_ids[selected] if selected is not None else None,
+                answers_price=answers_price,
+            )
+            purchased_services.append(purchased_service_obj)
+
+            for q in service['questions']:
+                question_obj = lookups.questions[q['id']]
+                qu_ans = QuestionsAndAnswers(
+                    purchase=purchase,
+                    purchased_service=purchased_service_obj,
+                    bool_ans=q['ans'],
+                    question_name=question_obj.text,
+                    question_type=question_obj.type,
+                    unit_price=question_obj.unit_price
+                )
+                answers.append(qu_ans)
+                if question_obj.type == 'boolean':
+                    continue
+                for key, value in q.get('options', {}).items():
+                    question_opt_obj = lookups.option(question_obj.id, key)
+                    option_answers.append(QuestionOptionAnswers(
+                        qu_ans=qu_ans,
+                        label=question_opt_obj.label,
+                        value=question_opt_obj.value,
+                        # extra_choice options are picked, not counted
+                        qty=None if question_obj.type == 'extra_choice' else value,
+                    ))
+
+        PurchasedService.objects.bulk_create(purchased_services)
+        QuestionsAndAnswers.objects.bulk_create(answers)
+        QuestionOptionAnswers.objects.bulk_create(option_answers)
+
+
+def add_custom_products(purchase, custom_products):
+    CustomProduct.objects.bulk_create([
+        CustomProduct(
+            purchase=purchase,
+            product_name=product.get('product_name'),
+            description=product.get('description'),
+            price=product.get('price')
+        )
+        for product in custom_products
+    ])
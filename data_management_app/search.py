@@ -0,0 +1,82 @@
+import re
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F, Q
+
+from .models import normalize_phone
+
+
+SEARCH_MODES = ['contains', 'prefix']
+PHONE_MATCHES = ['exact', 'suffix']
+
+# Shortest number accepted for an ends-with phone lookup
+MIN_PHONE_SUFFIX = 4
+
+# Characters with a meaning in tsquery syntax
+_TSQUERY_SPECIAL = re.compile(r"[':&|!()<>*\\]")
+
+
+def search_terms(query):
+    """
+    Split a search box value into lowercase terms that are safe to put in a tsquery
+    """
+    return _TSQUERY_SPECIAL.sub(' ', query).lower().split()
+
+
+def search_contacts(qs, query, mode='contains'):
+    """
+    Filter a Contact queryset by a search box value.
+
+    Args:
+        qs (QuerySet): Contacts to search in
+        query (str): Raw search value
+        mode (str): 'contains' matches contacts containing any of the words in
+            their name, email, phone or country through the trigram index;
+            'prefix' requires every word to start a word of the contact, through
+            the tsvector index, and ranks the results
+
+    Returns:
+        QuerySet ordered newest first (contains) or by relevance (prefix)
+    """
+    if mode == 'contains':
+        terms = query.lower().split()
+        if not terms:
+            return qs.order_by('-date_added')
+        any_term = Q()
+        for term in terms:
+            any_term |= Q(search_text__contains=term)
+        return qs.filter(any_term).order_by('-date_added')
+
+    terms = search_terms(query)
+    if not terms:
+        return qs.order_by('-date_added')
+    search_query = SearchQuery(
+        ' & '.join(f"'{term}':*" for term in terms),
+        search_type='raw',
+        config='simple',
+    )
+    return qs.filter(search_vector=search_query).annotate(
+        rank=SearchRank(F('search_vector'), search_query)
+    ).order_by('-rank', '-date_added')
+
+
+def search_phone(qs, phone, match='exact'):
+    """
+    Filter a Contact queryset by phone number, ignoring formatting.
+
+    Args:
+        qs (QuerySet): Contacts to search in
+        phone (str): Phone number in any format
+        match (str): 'exact' compares the full normalized number, 'suffix' matches
+            numbers ending with the given digits (e.g. a caller ID without country code)
+
+    Returns:
+        QuerySet ordered newest first, or None when the number has too few digits
+    """
+    digits = normalize_phone(phone)
+    if not digits or (match == 'suffix' and len(digits) < MIN_PHONE_SUFFIX):
+        return None
+    if match == 'suffix':
+        qs = qs.filter(phone_digits_reversed__startswith=digits[::-1])
+    else:
+        qs = qs.filter(phone_digits=digits)
+    return qs.order_by('-date_added')
@@ -1,15 +1,74 @@
 from rest_framework import serializers
 from django.db import transaction
+from .catalog import create_services, update_service_graph
+from .global_settings import resolve_global_settings
+from .pricing import check_total, price_services, quote_total, reprice_purchase
+from .purchases import PurchaseLookups, add_purchased_services, add_custom_products
 from .models import (
-    Service, Feature, PricingOption, PricingOptionFeature, 
+    Service, Feature, PricingOption,
     Question, QuestionOption, Contact, Purchase, GlobalSettings, PurchasedService, QuestionsAndAnswers, QuestionOptionAnswers,PurChasedServiceFeature,
-    PurchasedServicePlan, PlanFeature, CustomProduct, Address
+    PurchasedServicePlan, PlanFeature, CustomProduct, Address, InvoiceJob
 )
 
-class ContactSerializer(serializers.ModelSerializer):
+def requested_fields(request, param):
+    """
+    Comma separated names from a query parameter (?fields=..., ?expand=...),
+    or None when the parameter isn't given
+    """
+    if request is None or param not in request.query_params:
+        return None
+    return {name.strip() for name in request.query_params[param].split(',') if name.strip()}
+
+
+def wanted_fields(request, names, expandable=()):
+    """
+    The subset of names a read request asks for through ?fields= and ?expand=,
+    used by views to trim columns and prefetches to what will be serialized
+    """
+    fields = requested_fields(request, 'fields')
+    expand = requested_fields(request, 'expand')
+    return [
+        name for name in names
+        if (fields is None or name in fields or name in (expand or ()))
+        and (expand is None or name not in expandable or name in expand)
+    ]
+
+
+class DynamicFieldsMixin:
+    """
+    Sparse fieldsets for read requests: ?fields=a,b keeps only the listed fields and
+    ?expand=x,y inlines only the listed nested collections (expandable_fields), on top of ?fields.
+    Without either parameter the full representation is returned.
+    """
+    expandable_fields = []
+    computed_fields = []
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.omitted_fields = set()
+        request = self.context.get('request')
+        if request is None or request.method not in ('GET', 'HEAD'):
+            return
+
+        fields = requested_fields(request, 'fields')
+        if fields is not None:
+            self.omitted_fields |= (set(self.fields) | set(self.computed_fields)) - fields
+        expand = requested_fields(request, 'expand')
+        if expand is not None:
+            self.omitted_fields -= expand
+            self.omitted_fields |= set(self.expandable_fields) - expand
+        for name in self.omitted_fields:
+            self.fields.pop(name, None)
+
+    def wants(self, name):
+        return name not in self.omitted_fields
+
+
+class ContactSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Contact
-        fields = '__all__'
+        # Search columns: generated by the database (search_*) or filled from the phone by the GHL sync (phone_*)
+        exclude = ['search_vector', 'search_text', 'phone_digits', 'phone_digits_reversed']
 
 
 
@@ -21,6 +80,7 @@ class QuestionOptionSerializer(serializers.ModelSerializer):
 
 
 class QuestionSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(required=False)
     options = serializers.ListField(
         child=serializers.DictField(),
         write_only=True,
@@ -58,6 +118,7 @@ class SelectedFeatureSerializer(serializers.Serializer):
 
 
 class PricingOptionSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(required=False)
     selectedFeatures = SelectedFeatureSerializer(many=True, write_only=True, required=False)
     
     class Meta:
@@ -66,9 +127,6 @@ class PricingOptionSerializer(serializers.ModelSerializer):
             'id', 'name', 'discount', 'base_price', 
             'selectedFeatures', 'is_active'
         ]
-        extra_kwargs = {
-            'id': {'read_only': True}
-        }
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
@@ -83,7 +141,15 @@ class PricingOptionSerializer(serializers.ModelSerializer):
         return data
 
 
-class ServiceSerializer(serializers.ModelSerializer):
+class ServiceListSerializer(serializers.ListSerializer):
+    def create(self, validated_data):
+        return create_services(validated_data)
+
+
+class ServiceSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    expandable_fields = ['features', 'pricingOptions', 'questions']
+    computed_fields = ['minimum_price']
+
     features = FeatureSerializer(many=True, required=False)
     pricingOptions = PricingOptionSerializer(many=True, write_only=True, required=False)
     questions = QuestionSerializer(many=True, required=False)
@@ -96,6 +162,7 @@ class ServiceSerializer(serializers.ModelSerializer):
             'features', 'pricingOptions', 'questions', 
             'is_active', 'created_at', 'updated_at'
         ]
+        list_serializer_class = ServiceListSerializer
         extra_kwargs = {
             'id': {'read_only': True},
             'created_at': {'read_only': True},
@@ -103,80 +170,14 @@ class ServiceSerializer(serializers.ModelSerializer):
         }
 
     def create(self, validated_data):
-        # Handle both camelCase and snake_case
-        pricing_options_data = validated_data.pop('pricingOptions', [])
-        features_data = validated_data.pop('features', [])
-        questions_data = validated_data.pop('questions', [])
-
-        with transaction.atomic():
-            # Create service
-            service = Service.objects.create(
-                name=validated_data['name'],
-                description=validated_data.get('description', '')
-            )
-
-            # Create features
-            feature_mapping = {}  # Map frontend IDs to actual Feature objects
-            for feature_data in features_data:
-                frontend_id = feature_data.pop('id', None)
-                feature = Feature.objects.create(
-                    service=service,
-                    name=feature_data['name'],
-                    description=feature_data.get('description', '')
-                )
-                if frontend_id:
-                    feature_mapping[frontend_id] = feature
-
-            # Create questions
-            for question_data in questions_data:
-                print("question data: ", question_data)
-                options_data = question_data.pop('options', [])
-                question = Question.objects.create(
-                    service=service,
-                    text=question_data['text'],
-                    type=question_data['type'],
-                    unit_price=question_data.get('unit_price', 0),
-                    is_required=question_data.get('is_required', False),
-                    order=question_data.get('order', 0)
-                )
-                for i, option_dict in enumerate(options_data):
-                    key, value = list(option_dict.items())[0]  # Unpack the first (and only) key-value pair
-                    QuestionOption.objects.create(
-                        question=question,
-                        value=value,
-                        label=key,
-                        order=i
-                    )
-
-
-            # Create pricing options
-            for pricing_data in pricing_options_data:
-                selected_features_data = pricing_data.pop('selectedFeatures', [])
-                
-                pricing_option = PricingOption.objects.create(
-                    service=service,
-                    name=pricing_data['name'],
-                    discount=pricing_data.get('discount', 0),
-                    base_price=pricing_data.get('base_price', 0),
-                )
-
-                # Link features to pricing options
-                for selected_feature in selected_features_data:
-                    feature_id = selected_feature['id']
-                    if feature_id in feature_mapping:
-                        PricingOptionFeature.objects.create(
-                            pricing_option=pricing_option,
-                            feature=feature_mapping[feature_id],
-                            is_included=selected_feature['is_included']
-                        )
-
-        return service
+        return create_services([validated_data])[0]
 
     def update(self, instance, validated_data):
-        # Handle both camelCase and snake_case
-        pricing_options_data = validated_data.pop('pricingOptions', []) or validated_data.pop('pricing_options', [])
-        features_data = validated_data.pop('features', [])
-        questions_data = validated_data.pop('questions', [])
+        # Collections left out of a PATCH are kept; on PUT they are emptied
+        missing = None if self.partial else []
+        pricing_options_data = validated_data.pop('pricingOptions', validated_data.pop('pricing_options', missing))
+        features_data = validated_data.pop('features', missing)
+        questions_data = validated_data.pop('questions', missing)
 
         with transaction.atomic():
             # Update service basic info
@@ -184,74 +185,15 @@ class ServiceSerializer(serializers.ModelSerializer):
             instance.description = validated_data.get('description', instance.description)
             instance.save()
 
-            # Clear existing relationships
-            instance.features.all().delete()
-            instance.pricing_options.all().delete()
-            instance.questions.all().delete()
-
-            # Recreate features
-            feature_mapping = {}
-            for feature_data in features_data:
-                frontend_id = feature_data.pop('id', None)
-                feature = Feature.objects.create(
-                    service=instance,
-                    name=feature_data['name'],
-                    description=feature_data.get('description', '')
-                )
-                if frontend_id:
-                    feature_mapping[frontend_id] = feature
-
-            # Recreate questions
-            for question_data in questions_data:
-                options_data = question_data.pop('options', [])
-                question = Question.objects.create(
-                    service=instance,
-                    text=question_data['text'],
-                    type=question_data['type'],
-                    unit_price=question_data.get('unit_price', 0),
-                    is_required=question_data.get('is_required', False),
-                    order=question_data.get('order', 0)
-                )
-                print("option DataL ", options_data)
-                for i, option_value in enumerate(options_data):
-                    print(option_value)
-                    key, value = list(option_value.items())[0]
-
-                    QuestionOption.objects.create(
-                        question=question,
-                        value=value,
-                        label=key,
-                        order=i
-                    )
-
-            # Recreate pricing options
-            for pricing_data in pricing_options_data:
-                selected_features_data = (
-                    pricing_data.pop('selectedFeatures', []) or 
-                    pricing_data.pop('selected_features', [])
-                )
-                
-                pricing_option = PricingOption.objects.create(
-                    service=instance,
-                    name=pricing_data['name'],
-                    discount=pricing_data.get('discount', 0),
-                    base_price=pricing_data.get('base_price', 0),
-                )
-
-                for selected_feature in selected_features_data:
-                    feature_id = selected_feature['id']
-                    if feature_id in feature_mapping:
-                        PricingOptionFeature.objects.create(
-                            pricing_option=pricing_option,
-                            feature=feature_mapping[feature_id],
-                            is_included=selected_feature['is_included']
-                        )
+            update_service_graph(instance, features_data, pricing_options_data, questions_data)
 
         return instance
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
         # Add pricing options for read operations
+        if not self.wants('pricingOptions'):
+            return self.add_minimum_price(data)
         pricing_options = []
         for po in instance.pricing_options.all():
             po_data = {
@@ -271,12 +213,12 @@ class ServiceSerializer(serializers.ModelSerializer):
             pricing_options.append(po_data)
         
         data['pricingOptions'] = pricing_options
-        from data_management_app.models import GlobalSettings  # Adjust if it's in a different app
-        try:
-            settings = GlobalSettings.load()  # `load()` is a standard method for SingletonModel
-            data['minimum_price'] = settings.minimum_price
-        except GlobalSettings.DoesNotExist:
-            data['minimum_price'] = None
+        return self.add_minimum_price(data)
+
+    def add_minimum_price(self, data):
+        if not self.wants('minimum_price'):
+            return data
+        data['minimum_price'] = resolve_global_settings(self.context).minimum_price
         return data
     
 class QuestionOptionAnswersSerializer(serializers.ModelSerializer):
@@ -297,7 +239,7 @@ class QuestionsAndAnswersSerializer(serializers.ModelSerializer):
         fields = ['options', 'bool_ans', 'question_name', 'question_type', 'unit_price']
 
     def get_options(self, obj):
-        option_answers = QuestionOptionAnswers.objects.filter(qu_ans=obj)
+        option_answers = obj.questionoptionanswers_set.all()
         return QuestionOptionAnswersSerializer(option_answers, many=True).data
     
     def to_representation(self, instance):
@@ -399,14 +341,15 @@ class PurchasedServiceSerializer(serializers.ModelSerializer):
     questions = serializers.SerializerMethodField()
     class Meta:
         model = PurchasedService
-        exclude = ['purchase']
+        # answers_price is internal to pricing, clients only see the quote total
+        exclude = ['purchase', 'snapshot', 'answers_price']
 
     def get_features(self, obj):
         if not obj.selected_plan:
             return []
 
         # Get related PlanFeatures
-        features = obj.selected_plan.plan_feat.select_related('feature')
+        features = obj.selected_plan.plan_feat.all()
 
         return [
             {
@@ -418,20 +361,19 @@ class PurchasedServiceSerializer(serializers.ModelSerializer):
         ]
 
     def get_questions(self, obj):
-        purchase = self.context.get('purchase')
-        q_ans=QuestionsAndAnswers.objects.filter(purchase=purchase, purchased_service=obj)
+        q_ans = obj.answers.all()
         return QuestionsAndAnswersSerializer(q_ans, many=True).data
     
     def get_pricingOptions(self, instance):
-        return PurChasedServiceFeatureSerializer(instance.service_feature.all(), many=True).data
+        return PurChasedServiceFeatureSerializer(instance.snapshot_features(), many=True).data
     
     def get_price_plan(self, instance):
-        return PurchasedServicePlanSerializer(instance.service_feature_plans.all(), many=True).data
+        return PurchasedServicePlanSerializer(instance.snapshot_plans(), many=True).data
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
         pricing_options = []
-        for po in instance.service_feature_plans.all():
+        for po in instance.snapshot_plans():
             po_data = {
                 'id': po.id,
                 'name': po.name,
@@ -479,7 +421,7 @@ class PurchaseDetailSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Purchase
-        fields = ['id', 'contact', 'address', 'services', 'total_amount', 'is_submited', 'signature', 'custom_products']
+        fields = ['id', 'contact', 'address', 'services', 'total_amount', 'is_submited', 'signature', 'custom_products', 'version']
 
     def get_address(self, obj):
         address = obj.address
@@ -506,25 +448,22 @@ class PurchaseDetailSerializer(serializers.ModelSerializer):
         
     def to_representation(self, instance):
         data = super().to_representation(instance)
-        from data_management_app.models import GlobalSettings  # Adjust if it's in a different app
-        try:
-            settings = GlobalSettings.load()  # `load()` is a standard method for SingletonModel
-            data['minimum_price'] = settings.minimum_price
-        except GlobalSettings.DoesNotExist:
-            data['minimum_price'] = None
+        data['minimum_price'] = resolve_global_settings(self.context).minimum_price
         return data
     
 class QuestionAnswerInputSerializer(serializers.Serializer):
     id = serializers.IntegerField()
     ans = serializers.BooleanField()
     options = serializers.DictField(
-        child=serializers.IntegerField(),
+        # Quantities, a negative one would take money off the priced total
+        child=serializers.IntegerField(min_value=0),
         required=False
     )
 
 class ServiceWithAnswersInputSerializer(serializers.Serializer):
     id = serializers.IntegerField()
-    price_plan = serializers.PrimaryKeyRelatedField(queryset=PricingOption.objects.all())
+    # Resolved in bulk by PurchaseCreateSerializer.validate
+    price_plan = serializers.IntegerField()
     questions = QuestionAnswerInputSerializer(many=True)
 
 class CustomProductSerializer(serializers.ModelSerializer):
@@ -540,7 +479,8 @@ class PurchaseCreateSerializer(serializers.Serializer):
     address = serializers.PrimaryKeyRelatedField(queryset=Address.objects.all(), allow_null=True, required=False)
     services = ServiceWithAnswersInputSerializer(many=True,required=False)
     custom_products = CustomProductSerializer(many=True, required=False)
-    total_amount = serializers.DecimalField(max_digits=10, decimal_places=2)
+    # Priced on the server when left out, see pricing.py
+    total_amount = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
     is_submited = serializers.BooleanField(read_only=True)
 
     def validate(self, data):
@@ -551,218 +491,40 @@ class PurchaseCreateSerializer(serializers.Serializer):
             raise serializers.ValidationError(
                 "At least one of 'services' or 'custom_products' must be provided."
             )
+
+        # Every catalog row the quote refers to, resolved in a few queries
+        self.lookups = PurchaseLookups(services)
+        self.lookups.validate(services)
+
+        if self.instance is None:
+            priced_total = quote_total(
+                price_services(services, self.lookups), custom_products,
+                resolve_global_settings(self.context).minimum_price,
+            )
+            data['total_amount'] = check_total('total_amount', data.get('total_amount'), priced_total, 'new purchase')
         return data
 
     def create(self, validated_data):
-        contact = validated_data['contact']
-        address = validated_data['address']
-        total_amount = validated_data['total_amount']
-        services_data = validated_data['services']
         custom_products = validated_data.get('custom_products', [])
 
-        purchase = Purchase.objects.create(
-            contact=contact,
-            address=address,
-            total_amount=total_amount,
-        )
-
-        for service in services_data:
-            service_id = service['id']
-            service_obj = Service.objects.get(id=service_id)
-            pricing_plan = service['price_plan']
-
-            purchased_service_obj=PurchasedService.objects.create(
-                purchase=purchase,
-                service_name=service_obj.name,
-                description=service_obj.description
+        with transaction.atomic():
+            purchase = Purchase.objects.create(
+                contact=validated_data['contact'],
+                address=validated_data.get('address'),
+                total_amount=validated_data['total_amount'],
             )
-
-            print(pricing_plan, 'pricinggggddd')
-
-            pricing_options = PricingOption.objects.filter(service=service_obj)
-            selected_plan = None
-            for option in pricing_options:
-                print(option, 'optionn')
-                purchased_pricing_plan_obj = PurchasedServicePlan.objects.create(purchased_service=purchased_service_obj, name=option.name, discount=option.discount)
-                features = pricing_plan.selected_features.all()
-                for feat in features:
-                    p_feat_obj=PurChasedServiceFeature.objects.create(purchased_service=purchased_service_obj, name=feat.feature.name, description=feat.feature.description)
-
-                    PlanFeature.objects.create(purchased_service_plan=purchased_pricing_plan_obj, feature=p_feat_obj, is_included=feat.is_included)     
-                if option == pricing_plan:
-                    print('selected', option)
-                    selected_plan = purchased_pricing_plan_obj
-            
-            purchased_service_obj.selected_plan = selected_plan
-            purchased_service_obj.save()
-
-
-
-            questions = service['questions']
-            for q in questions:
-                try:
-                    question_obj = Question.objects.get(id=q['id'])
-                    if question_obj.type=='boolean':
-                        QuestionsAndAnswers.objects.create(
-                            purchase=purchase,
-                            purchased_service=purchased_service_obj,
-                            bool_ans=q['ans'],
-                            question_name=question_obj.text,
-                            question_type=question_obj.type,
-                            unit_price=question_obj.unit_price
-                        )
-                    elif question_obj.type=='extra_choice':
-                        qu_ans = QuestionsAndAnswers.objects.create(
-                            purchase=purchase,
-                            purchased_service=purchased_service_obj,
-                            bool_ans=q['ans'],
-                            question_name=question_obj.text,
-                            question_type=question_obj.type,
-                            unit_price=question_obj.unit_price
-                        )
-                        options_data = q.get('options', {})
-                        for key, value in options_data.items():
-                            try:
-                                question_opt_obj = QuestionOption.objects.get(question=question_obj, label__iexact=key)
-                                QuestionOptionAnswers.objects.create(
-                                    qu_ans=qu_ans,
-                                    label=question_opt_obj.label,
-                                    value=question_opt_obj.value,
-                                )
-                            except QuestionOption.DoesNotExist:
-                                raise serializers.ValidationError(
-                                    f"QuestionOption '{key}' not found for Question ID {question_obj.id}"
-                                )
-                    else:
-                        qu_ans = QuestionsAndAnswers.objects.create(
-                            purchase=purchase,
-                            purchased_service=purchased_service_obj,
-                            bool_ans=q['ans'],
-                            question_name=question_obj.text,
-                            question_type=question_obj.type,
-                            unit_price=question_obj.unit_price
-                        )
-                        options_data = q.get('options', {})
-                        for key, value in options_data.items():
-                            try:
-                                question_opt_obj = QuestionOption.objects.get(question=question_obj, label__iexact=key)
-                                QuestionOptionAnswers.objects.create(
-                                    qu_ans=qu_ans,
-                                    qty=value,
-                                    label=question_opt_obj.label,
-                                    value=question_opt_obj.value,
-                                )
-                            except QuestionOption.DoesNotExist:
-                                raise serializers.ValidationError(
-                                    f"QuestionOption '{key}' not found for Question ID {question_obj.id}"
-                                )
-                except Question.DoesNotExist:
-                    raise serializers.ValidationError(f"Question with id {q['id']} not found")
-        if custom_products:
-            print(custom_products, 'hiii')
-            for custom_product in custom_products:
-                CustomProduct.objects.create(purchase=purchase, product_name=custom_product.get('product_name'), description=custom_product.get('description'), price=custom_product.get('price'))
-        else:
-            print('nOO custom product')
+            add_purchased_services(purchase, validated_data.get('services', []), self.lookups)
+            add_custom_products(purchase, custom_products)
 
         return purchase
     
     def update(self, instance, validated_data):
-        services_data = validated_data.get('services', [])
-        custom_products = validated_data.get('custom_products', [])
-
-        for service in services_data:
-            service_id = service['id']
-            service_obj = Service.objects.get(id=service_id)
-            pricing_plan = service['price_plan']
-
-            purchased_service_obj = PurchasedService.objects.create(
-                purchase=instance,
-                service_name=service_obj.name,
-                description=service_obj.description
-            )
-
-            pricing_options = PricingOption.objects.filter(service=service_obj)
-            selected_plan = None
-            for option in pricing_options:
-                purchased_pricing_plan_obj = PurchasedServicePlan.objects.create(
-                    purchased_service=purchased_service_obj,
-                    name=option.name,
-                    discount=option.discount
-                )
-
-                features = pricing_plan.selected_features.all()
-                for feat in features:
-                    p_feat_obj = PurChasedServiceFeature.objects.create(
-                        purchased_service=purchased_service_obj,
-                        name=feat.feature.name,
-                        description=feat.feature.description
-                    )
-                    PlanFeature.objects.create(
-                        purchased_service_plan=purchased_pricing_plan_obj,
-                        feature=p_feat_obj,
-                        is_included=feat.is_included
-                    )
-                if option == pricing_plan:
-                    selected_plan = purchased_pricing_plan_obj
-
-            purchased_service_obj.selected_plan = selected_plan
-            purchased_service_obj.save()
-
-            for q in service['questions']:
-                try:
-                    question_obj = Question.objects.get(id=q['id'])
-                    if question_obj.type == 'boolean':
-                        QuestionsAndAnswers.objects.create(
-                            purchase=instance,
-                            purchased_service=purchased_service_obj,
-                            bool_ans=q['ans'],
-                            question_name=question_obj.text,
-                            question_type=question_obj.type,
-                            unit_price=question_obj.unit_price
-                        )
-                    elif question_obj.type == 'extra_choice':
-                        qu_ans = QuestionsAndAnswers.objects.create(
-                            purchase=instance,
-                            purchased_service=purchased_service_obj,
-                            bool_ans=q['ans'],
-                            question_name=question_obj.text,
-                            question_type=question_obj.type,
-                            unit_price=question_obj.unit_price
-                        )
-                        for key, value in q.get('options', {}).items():
-                            question_opt_obj = QuestionOption.objects.get(question=question_obj, label__iexact=key)
-                            QuestionOptionAnswers.objects.create(
-                                qu_ans=qu_ans,
-                                label=question_opt_obj.label,
-                                value=question_opt_obj.value
-                            )
-                    else:
-                        qu_ans = QuestionsAndAnswers.objects.create(
-                            purchase=instance,
-                            purchased_service=purchased_service_obj,
-                            bool_ans=q['ans'],
-                            question_name=question_obj.text,
-                            question_type=question_obj.type,
-                            unit_price=question_obj.unit_price
-                        )
-                        for key, value in q.get('options', {}).items():
-                            question_opt_obj = QuestionOption.objects.get(question=question_obj, label__iexact=key)
-                            QuestionOptionAnswers.objects.create(
-                                qu_ans=qu_ans,
-                                label=question_opt_obj.label,
-                                value=question_opt_obj.value,
-                                qty=value
-                            )
-                except Question.DoesNotExist:
-                    raise serializers.ValidationError(f"Question with id {q['id']} not found")
-
-        for product in custom_products:
-            CustomProduct.objects.create(
-                purchase=instance,
-                product_name=product.get('product_name'),
-                description=product.get('description'),
-                price=product.get('price')
+        with transaction.atomic():
+            add_purchased_services(instance, validated_data.get('services', []), self.lookups)
+            add_custom_products(instance, validated_data.get('custom_products', []))
+            # The added lines change the total, priced from what is recorded on the quote
+            reprice_purchase(
+                instance, resolve_global_settings(self.context).minimum_price, validated_data.get('total_amount')
             )
 
         return instance
@@ -784,7 +546,8 @@ class FinalSubmissionServicePlanSerializer(serializers.Serializer):
     
 class FinalSubmissionSerializer(serializers.Serializer):
     purchase_id = serializers.IntegerField()
-    total_amount = serializers.DecimalField(max_digits=10, decimal_places=2)
+    # Checked against (or filled from) the recorded prices by FinalSubmition
+    total_amount = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
     signature = serializers.CharField()
     services = FinalSubmissionServicePlanSerializer(many=True)
 
@@ -796,9 +559,34 @@ class FinalSubmissionSerializer(serializers.Serializer):
                 raise serializers.ValidationError("Purchase is already submitted.")
         except Purchase.DoesNotExist:
             raise serializers.ValidationError("Purchase not found.")
+
+        # Only the plans offered on this quote can be selected
+        purchased_services = PurchasedService.objects.filter(
+            purchase=purchase, id__in=[service['service_id'] for service in data['services']]
+        ).in_bulk()
+        for service in data['services']:
+            purchased_service = purchased_services.get(service['service_id'])
+            if purchased_service is None:
+                raise serializers.ValidationError(
+                    {'services': f"Service {service['service_id']} is not part of purchase {purchase.id}."}
+                )
+            plan = service['price_plan']
+            if purchased_service.snapshot_id:
+                offered = plan.snapshot_id == purchased_service.snapshot_id
+            else:
+                offered = plan.purchased_service_id == purchased_service.id
+            if not offered:
+                raise serializers.ValidationError(
+                    {'services': f"Plan {plan.id} is not offered for service {purchased_service.id}."}
+                )
         return data
 
 class AddressSerializer(serializers.ModelSerializer):
     class Meta:
         model = Address
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+
+class InvoiceJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = InvoiceJob
+        fields = ['id', 'location_id', 'status', 'attempts', 'product_id', 'invoice_id', 'error', 'created_at', 'updated_at']
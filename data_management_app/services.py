@@ -1,9 +1,38 @@
 import requests
+import time
 import pytz
+from django.conf import settings
+from django.core.cache import cache
 from data_management_app.models import Contact
 
 BST = pytz.timezone("America/Chicago")
 
+
+def acquire_location_rate_slot(location_id):
+        """
+        Fixed-window rate limiter shared by all workers through the cache.
+        Returns 0 when a slot was taken, otherwise the seconds to wait before retrying.
+        """
+        window = settings.GHL_INVOICE_RATE_WINDOW
+        now = time.time()
+        bucket = int(now // window)
+        key = f"ghl-invoice-rate:{location_id}:{bucket}"
+
+        cache.add(key, 0, timeout=window * 2)
+        if cache.incr(key) <= settings.GHL_INVOICE_RATE_LIMIT:
+            return 0
+        return max(1, int((bucket + 1) * window - now) + 1)
+
+
+# GHL answers these when it is overloaded or rate limiting, the request is worth retrying
+TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def raise_for_transient_status(response):
+    if response.status_code in TRANSIENT_STATUS_CODES:
+        raise requests.HTTPError(f"GHL returned {response.status_code}", response=response)
+
+
 def get_or_create_product( access_token, location_id, product_name, custom_data):
         
         """
@@ -20,6 +49,7 @@ def get_or_create_product( access_token, location_id, product_name, custom_data)
         
         try:
             response = requests.get(search_url, headers=headers)
+            raise_for_transient_status(response)
             if response.status_code == 200:
                 products = response.json().get('products', [])
                 if products:
@@ -31,6 +61,9 @@ def get_or_create_product( access_token, location_id, product_name, custom_data)
                 
             else:
                  print("response error: ", response.text)
+        except requests.RequestException:
+            # Creating a product now could duplicate an existing one, let the job retry
+            raise
         except Exception as e:
             print(f"Error searching for product: {e}")
         
@@ -70,6 +103,7 @@ def create_product( access_token, location_id, product_name, custom_data):
         
         try:
             response = requests.post(url, headers=headers, json=product_data)
+            raise_for_transient_status(response)
             if response.status_code in [200, 201]:
                 product = response.json()
                 print("product: ", product)
@@ -77,6 +111,8 @@ def create_product( access_token, location_id, product_name, custom_data):
             else:
                 print(f"Failed to create product: {response.status_code} - {response.text}")
                 return None
+        except requests.RequestException:
+            raise
         except Exception as e:
             print(f"Error creating product: {e}")
             return None
@@ -201,11 +237,14 @@ def create_invoice( access_token, webhook_data, product_id, product_name):
         
         try:
             response = requests.post(url, headers=headers, json=invoice_data)
+            raise_for_transient_status(response)
             if response.status_code in [200, 201]:
                 return response.json()
             else:
                 print(f"Failed to create invoice: {response.status_code} - {response.text}")
                 return None
+        except requests.RequestException:
+            raise
         except Exception as e:
             print(f"Error creating invoice: {e}")
             return None
\ No newline at end of file
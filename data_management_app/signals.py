@@ -0,0 +1,49 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from data_management_app.models import (
+    Service, Feature, PricingOption, PricingOptionFeature, Question, QuestionOption, GlobalSettings,
+    Contact, Address, Purchase
+)
+from data_management_app.catalog import bump_catalog_version
+from data_management_app.global_settings import invalidate_global_settings
+from data_management_app.purchase_documents import invalidate_reviews
+
+
+CATALOG_MODELS = [Service, Feature, PricingOption, PricingOptionFeature, Question, QuestionOption, GlobalSettings]
+
+
+def catalog_changed(sender, **kwargs):
+    # Bulk writes don't send signals, catalog.py bumps the version itself for those
+    bump_catalog_version()
+
+
+for model in CATALOG_MODELS:
+    post_save.connect(catalog_changed, sender=model, dispatch_uid=f'catalog-changed-save-{model.__name__}')
+    post_delete.connect(catalog_changed, sender=model, dispatch_uid=f'catalog-changed-delete-{model.__name__}')
+
+
+def global_settings_changed(sender, **kwargs):
+    # Wait for the commit so other processes don't reload the old row
+    transaction.on_commit(invalidate_global_settings)
+
+
+post_save.connect(global_settings_changed, sender=GlobalSettings, dispatch_uid='global-settings-changed-save')
+post_delete.connect(global_settings_changed, sender=GlobalSettings, dispatch_uid='global-settings-changed-delete')
+
+
+def purchase_deleted(sender, instance, **kwargs):
+    invalidate_reviews([instance.pk])
+
+
+def contact_saved(sender, instance, **kwargs):
+    # Reviews render the contact; bulk syncs don't send signals and wait for the cache TTL
+    invalidate_reviews(Purchase.objects.filter(contact=instance).values_list('id', flat=True))
+
+
+def address_saved(sender, instance, **kwargs):
+    invalidate_reviews(Purchase.objects.filter(address=instance).values_list('id', flat=True))
+
+
+post_delete.connect(purchase_deleted, sender=Purchase, dispatch_uid='purchase-review-delete')
+post_save.connect(contact_saved, sender=Contact, dispatch_uid='purchase-review-contact-save')
+post_save.connect(address_saved, sender=Address, dispatch_uid='purchase-review-address-save')
@@ -1,7 +1,14 @@
+import requests
+from datetime import timedelta
 from celery import shared_task
-from accounts.models import GHLAuthCredentials
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from accounts.credentials import get_credentials
 from django.utils.dateparse import parse_datetime
 from data_management_app.helpers import create_or_update_contact, delete_contact
+from data_management_app.models import InvoiceJob
+from data_management_app.services import get_or_create_product, create_invoice, acquire_location_rate_slot
 
 
 @shared_task
@@ -12,4 +19,92 @@ def handle_webhook_event(data, event_type):
         elif event_type == "ContactDelete":
             delete_contact(data)
     except Exception as e:
-        print(f"Error handling webhook event: {str(e)}")
\ No newline at end of file
+        print(f"Error handling webhook event: {str(e)}")
+
+
+@shared_task(bind=True, max_retries=None)
+def process_invoice_job(self, job_id):
+    """
+    Create the GHL product/invoice for a queued InvoiceJob.
+    Jobs are claimed with a conditional update so a redelivered task never runs a job twice.
+    """
+    job = InvoiceJob.objects.filter(id=job_id).only('id', 'location_id', 'status').first()
+    if not job or job.status != InvoiceJob.STATUS_PENDING:
+        return
+
+    retry_in = acquire_location_rate_slot(job.location_id)
+    if retry_in:
+        raise self.retry(countdown=retry_in)
+
+    claimed = InvoiceJob.objects.filter(id=job_id, status=InvoiceJob.STATUS_PENDING).update(
+        status=InvoiceJob.STATUS_PROCESSING,
+        attempts=F('attempts') + 1,
+        updated_at=timezone.now(),
+    )
+    if not claimed:
+        return
+
+    job = InvoiceJob.objects.get(id=job_id)
+    webhook_data = job.payload
+    custom_data = webhook_data.get("customData", {})
+    product_name = custom_data.get("Product Name")
+
+    try:
+        token = get_credentials(job.location_id)
+        if not token:
+            raise Exception("Authentication credentials not found")
+
+        product_id = job.product_id or get_or_create_product(token.access_token, job.location_id, product_name, custom_data)
+        if not product_id:
+            raise Exception("Failed to get or create product")
+        job.product_id = product_id
+
+        invoice_result = create_invoice(token.access_token, webhook_data, product_id, product_name)
+        print("invoice result: :", invoice_result)
+        if not invoice_result:
+            raise Exception("Failed to create invoice")
+
+        job.invoice_id = invoice_result.get("_id") or invoice_result.get("id")
+        job.status = InvoiceJob.STATUS_COMPLETED
+        job.error = None
+    except requests.RequestException as e:
+        # Network errors and GHL 429/5xx: hand the job back and try again later
+        job.error = str(e)
+        if job.attempts < settings.GHL_INVOICE_MAX_ATTEMPTS:
+            print(f"Invoice job {job_id} attempt {job.attempts} failed, retrying: {e}")
+            job.status = InvoiceJob.STATUS_PENDING
+            job.save(update_fields=['product_id', 'status', 'error', 'updated_at'])
+            countdown = min(settings.GHL_INVOICE_RETRY_BACKOFF * 2 ** (job.attempts - 1), settings.GHL_INVOICE_RETRY_BACKOFF_MAX)
+            raise self.retry(exc=e, countdown=countdown)
+        print(f"Invoice job {job_id} failed after {job.attempts} attempts: {e}")
+        job.status = InvoiceJob.STATUS_FAILED
+    except Exception as e:
+        print(f"Invoice job {job_id} failed: {e}")
+        job.status = InvoiceJob.STATUS_FAILED
+        job.error = str(e)
+
+    job.save(update_fields=['product_id', 'invoice_id', 'status', 'error', 'updated_at'])
+
+
+@shared_task
+def requeue_stale_invoice_jobs():
+    """
+    Re-enqueue jobs nobody is working on: pending jobs whose task was never
+    delivered (enqueue failed after the row was created) and processing jobs
+    whose worker died mid-run. A job that is really still running is safe too,
+    the pending claim in process_invoice_job lets only one task through.
+    """
+    stale_before = timezone.now() - timedelta(seconds=settings.GHL_INVOICE_STALE_AFTER)
+    stale = InvoiceJob.objects.filter(
+        status__in=[InvoiceJob.STATUS_PENDING, InvoiceJob.STATUS_PROCESSING], updated_at__lt=stale_before
+    )
+    job_ids = list(stale.values_list('id', flat=True))
+    if not job_ids:
+        return
+    # Release the abandoned claims, a worker that finishes late just saves its result over this
+    InvoiceJob.objects.filter(id__in=job_ids, status=InvoiceJob.STATUS_PROCESSING, updated_at__lt=stale_before).update(
+        status=InvoiceJob.STATUS_PENDING, updated_at=timezone.now()
+    )
+    for job_id in job_ids:
+        process_invoice_job.delay(job_id)
+    print(f"Requeued {len(job_ids)} stale invoice jobs")
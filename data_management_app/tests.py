@@ -1,3 +1,443 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.test import APIClient
+
+from .catalog import create_services, update_service_graph
+from .global_settings import invalidate_global_settings
+from .pricing import check_total, quote_total
+from .models import (
+    CatalogSnapshot, Contact, GlobalSettings, Purchase, PurchasedServicePlan,
+    PurChasedServiceFeature, QuestionOption,
+)
+from .serializers import PurchaseDetailSerializer
+from .typeahead import PrefixIndex, reload_location
+
+
+class ContactCursorPaginationTests(TestCase):
+    url = '/api/data/contacts/search/'
+
+    def setUp(self):
+        self.client = APIClient()
+        now = timezone.now()
+        for i in range(9):
+            Contact.objects.create(
+                contact_id=f'zeta-{i}', first_name='zeta zeta' if i % 3 == 0 else 'zeta', last_name='Quinn',
+                email=f'z{i}@example.com', location_id='loc-1', date_added=now - timedelta(minutes=i),
+            )
+
+    def walk(self, params):
+        pages = []
+        url = f'{self.url}?location_id=loc-1&pagination=cursor&page_size=2&{params}'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([contact['contact_id'] for contact in response.data['results']])
+            url = response.data['next']
+        return pages
+
+    def listing(self, params):
+        response = self.client.get(f'{self.url}?location_id=loc-1&page_size=100&{params}')
+        return [contact['contact_id'] for contact in response.data['results']]
+
+    def test_pages_follow_newest_first_listing(self):
+        pages = self.walk('search=zeta')
+        self.assertEqual(len(pages), 5)
+        self.assertEqual(sum(pages, []), [f'zeta-{i}' for i in range(9)])
+
+    def test_ranked_search_keeps_rank_order_across_pages(self):
+        ranked = self.listing('search=zeta&mode=prefix')
+        # The double matches rank first
+        self.assertEqual(ranked[:3], ['zeta-0', 'zeta-3', 'zeta-6'])
+        self.assertEqual(sum(self.walk('search=zeta&mode=prefix'), []), ranked)
+
+    def test_previous_link_returns_previous_page(self):
+        url = f'{self.url}?location_id=loc-1&pagination=cursor&page_size=2&search=zeta&mode=prefix'
+        first = self.client.get(url).data
+        second = self.client.get(first['next']).data
+        back = self.client.get(second['previous']).data
+        self.assertEqual(back['results'], first['results'])
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get(f'{self.url}?pagination=cursor&cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+
+def contact_entry(pk, first_name, last_name, phone_digits=None):
+    return {
+        'id': pk, 'contact_id': f'c{pk}', 'first_name': first_name, 'last_name': last_name,
+        'email': f'{first_name}.{last_name}@example.com'.lower(), 'phone': None, 'phone_digits': phone_digits,
+    }
+
+
+class PrefixIndexTests(TestCase):
+    def setUp(self):
+        self.index = PrefixIndex([
+            contact_entry(1, 'John', 'Smith', '15550102030'),
+            contact_entry(2, 'Johanna', 'Smythe'),
+            contact_entry(3, 'Mary', 'Johnson', '442071234567'),
+        ])
+
+    def lookup(self, query, limit=10):
+        return [entry['id'] for entry in self.index.lookup(query, limit)]
+
+    def test_matches_name_and_email_prefixes(self):
+        self.assertEqual(self.lookup('joh'), [2, 1, 3])
+        self.assertEqual(self.lookup('SMY'), [2])
+        self.assertEqual(self.lookup('mary.j'), [3])
+
+    def test_every_word_must_match(self):
+        self.assertEqual(self.lookup('john sm'), [1])
+        self.assertEqual(self.lookup('smith joh'), [1])
+        self.assertEqual(self.lookup('john x'), [])
+
+    def test_phone_numbers_match_whatever_their_format(self):
+        self.assertEqual(self.lookup('555-010'), [1])
+        self.assertEqual(self.lookup('(555) 010-2030'), [1])
+        self.assertEqual(self.lookup('+1 555 010'), [1])
+        self.assertEqual(self.lookup('0044 20'), [3])
+        self.assertEqual(self.lookup('john 555.01'), [1])
+
+    def test_limit_caps_results(self):
+        self.assertEqual(len(self.lookup('j', limit=2)), 2)
+
+    def test_upsert_and_remove_update_keys(self):
+        self.index.upsert(contact_entry(2, 'Joanna', 'Smythe'))
+        self.assertEqual(self.lookup('joha'), [])
+        self.assertEqual(self.lookup('joan'), [2])
+        self.index.remove(2)
+        self.assertEqual(self.lookup('smy'), [])
+        self.assertEqual(len(self.index), 2)
+
+
+class ContactAutocompleteViewTests(TestCase):
+    url = '/api/data/contacts/autocomplete/'
+
+    def setUp(self):
+        self.client = APIClient()
+        for i in range(3):
+            Contact.objects.create(contact_id=f'auto-{i}', first_name='Autumn', location_id='loc-auto')
+        # Indexes live for the process, start from this test's rows
+        reload_location('loc-auto')
+
+    def test_limit_is_clamped(self):
+        response = self.client.get(self.url, {'location_id': 'loc-auto', 'q': 'aut', 'limit': 0})
+        self.assertEqual(len(response.data['results']), 1)
+        response = self.client.get(self.url, {'location_id': 'loc-auto', 'q': 'aut', 'limit': 500})
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_non_numeric_limit_is_rejected(self):
+        response = self.client.get(self.url, {'location_id': 'loc-auto', 'q': 'aut', 'limit': 'ten'})
+        self.assertEqual(response.status_code, 400)
+
+
+class QuoteFixtureMixin:
+    """
+    A catalog of services with every question type and a contact to quote them for.
+    GHL calls of the purchase views are patched out.
+    """
+
+    # Per service with plan 1 (10 less 5%) and the answers of quote_payload:
+    # 9.50 + edging 3 + bags (2 * 3 + 1 * 4.25) + extras (3 + 4.25) = 30.00
+    SERVICE_TOTAL = Decimal('30.00')
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        for target in ('update_contact', 'add_tags'):
+            patcher = mock.patch(f'data_management_app.views.{target}', return_value=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        settings = GlobalSettings.load()
+        settings.minimum_price = 0
+        settings.save()
+        invalidate_global_settings()
+        self.contact = Contact.objects.create(contact_id='quote-contact', first_name='Quinn', location_id='loc-quote')
+
+    def make_service(self, name):
+        [service] = create_services([{
+            'name': name,
+            'description': 'Lawn care',
+            'features': [{'id': i, 'name': f'Feature {i}', 'description': ''} for i in range(1, 4)],
+            'questions': [
+                {'text': 'Edging?', 'type': 'boolean', 'unit_price': 3, 'order': 0},
+                {'text': 'Bags', 'type': 'choice', 'unit_price': 3, 'order': 1, 'options': [{'Small': '1'}, {'Large': '2'}]},
+                {'text': 'Extras', 'type': 'extra_choice', 'unit_price': 3, 'order': 2, 'options': [{'Small': '1'}, {'Large': '2'}]},
+            ],
+            'pricingOptions': [
+                {'name': f'Plan {i}', 'discount': 5 * i, 'base_price': 10,
+                 'selectedFeatures': [{'id': j, 'is_included': (i + j) % 2 == 0} for j in range(1, 4)]}
+                for i in range(3)
+            ],
+        }])
+        QuestionOption.objects.filter(question__service=service, label='Large').update(additional_price=Decimal('1.25'))
+        return service
+
+    def quote_payload(self, services, plan_index=1):
+        return {
+            'contact': self.contact.contact_id,
+            'custom_products': [{'product_name': 'Gate key', 'description': '', 'price': 5}],
+            'services': [
+                {
+                    'id': service.id,
+                    'price_plan': service.pricing_options.order_by('name')[plan_index].id,
+                    'questions': [
+                        {'id': question.id, 'ans': True, 'options': {} if question.type == 'boolean' else {'small': 2, 'LARGE': 1}}
+                        for question in service.questions.all()
+                    ],
+                }
+                for service in services
+            ],
+        }
+
+    def create_quote(self, services, **payload):
+        response = self.client.post('/api/data/purchase/', {**self.quote_payload(services), **payload}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return Purchase.objects.get(id=response.data['id'])
+
+
+class CatalogSnapshotTests(QuoteFixtureMixin, TestCase):
+    def test_quotes_of_an_unchanged_catalog_share_one_snapshot(self):
+        service = self.make_service('Mowing')
+        first = self.create_quote([service])
+        counts = (PurchasedServicePlan.objects.count(), PurChasedServiceFeature.objects.count())
+        second = self.create_quote([service])
+
+        self.assertEqual(first.service_plans.get().snapshot_id, second.service_plans.get().snapshot_id)
+        self.assertEqual((PurchasedServicePlan.objects.count(), PurChasedServiceFeature.objects.count()), counts)
+
+    def test_snapshot_holds_each_feature_once(self):
+        service = self.make_service('Mowing')
+        purchased_service = self.create_quote([service]).service_plans.get()
+
+        self.assertEqual(
+            list(purchased_service.snapshot_features().values_list('name', flat=True)),
+            ['Feature 1', 'Feature 2', 'Feature 3'],
+        )
+        plans = list(purchased_service.snapshot_plans().order_by('id'))
+        self.assertEqual([plan.name for plan in plans], ['Plan 0', 'Plan 1', 'Plan 2'])
+        self.assertEqual(purchased_service.selected_plan, plans[1])
+        for plan in plans:
+            self.assertEqual(plan.plan_feat.count(), 3)
+
+    def test_catalog_change_starts_a_new_snapshot(self):
+        service = self.make_service('Mowing')
+        first = self.create_quote([service]).service_plans.get()
+        update_service_graph(service, features_data=[
+            {'id': feature.id, 'name': f'{feature.name} (weekly)'} for feature in service.features.all()
+        ])
+        second = self.create_quote([service]).service_plans.get()
+
+        self.assertNotEqual(first.snapshot_id, second.snapshot_id)
+        self.assertEqual(CatalogSnapshot.objects.filter(id__in=[first.snapshot_id, second.snapshot_id]).count(), 2)
+        # The earlier quote still shows the catalog it was made with
+        self.assertEqual(first.snapshot_features().first().name, 'Feature 1')
+
+    def test_details_render_in_fixed_number_of_queries(self):
+        services = [self.make_service(f'Service {i}') for i in range(4)]
+        small, large = self.create_quote(services[:1]), self.create_quote(services)
+
+        def render_queries(purchase):
+            with CaptureQueriesContext(connection) as queries:
+                PurchaseDetailSerializer(Purchase.objects.with_details().get(pk=purchase.pk)).data
+            return len(queries)
+
+        render_queries(small)
+        self.assertEqual(render_queries(large), render_queries(small))
+
+
+class ReviewResponseTests(QuoteFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        services = [self.make_service(f'Service {i}') for i in range(2)]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.purchase = self.create_quote(services)
+
+    def review(self, **headers):
+        return self.client.get(f'/api/data/user/review/{self.purchase.id}/', headers=headers)
+
+    def delete(self, path):
+        # Review cache entries are dropped on commit
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.delete(f'/api/data/{path}/?response=delta')
+
+    def test_unchanged_review_is_not_modified(self):
+        response = self.review()
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        response = self.review(if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_review_is_cached_until_the_contact_changes(self):
+        self.review()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.review().json()['contact']['first_name'], 'Quinn')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.contact.first_name = 'Quincy'
+            self.contact.save()
+        self.assertEqual(self.review().json()['contact']['first_name'], 'Quincy')
+
+    def test_custom_product_delete_returns_delta(self):
+        etag = self.review()['ETag']
+        version = self.review().json()['version']
+        product = self.purchase.custom_products.get()
+
+        response = self.delete(f'custom-product/delete/{product.id}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['purchase_id'], self.purchase.id)
+        self.assertEqual(response.data['removed_id'], product.id)
+        self.assertEqual(response.data['version'], version + 1)
+        self.assertEqual(response.data['totals']['custom_product_count'], 0)
+        self.assertEqual(response.data['totals']['custom_products_total'], 0)
+        self.assertEqual(response.data['totals']['service_count'], 2)
+        self.assertEqual(Decimal(str(response.data['totals']['total_amount'])), 2 * self.SERVICE_TOTAL)
+
+        # The review moved on with the delete
+        response = self.review(if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['version'], version + 1)
+        self.assertEqual(response.json()['custom_products'], [])
+
+    def test_purchased_service_delete_returns_delta(self):
+        purchased_service = self.purchase.service_plans.order_by('id').first()
+
+        response = self.delete(f'purchased-service/delete/{purchased_service.id}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['removed_id'], purchased_service.id)
+        self.assertEqual(response.data['totals']['service_count'], 1)
+        self.assertEqual(Decimal(str(response.data['totals']['total_amount'])), self.SERVICE_TOTAL + 5)
+        self.purchase.refresh_from_db()
+        self.assertEqual(self.purchase.total_amount, self.SERVICE_TOTAL + 5)
+
+    def test_delete_without_delta_returns_full_review(self):
+        product = self.purchase.custom_products.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(f'/api/data/custom-product/delete/{product.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('ETag', response)
+        self.assertEqual(response.json()['id'], self.purchase.id)
+        self.assertEqual(len(response.json()['services']), 2)
+
+
+class PricingTests(QuoteFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.service = self.make_service('Mowing')
+
+    def submit(self, purchase, plan, **payload):
+        purchased_service = purchase.service_plans.get()
+        return self.client.post(f'/api/data/quotes/{purchase.id}/submit/', {
+            'purchase_id': purchase.id,
+            'signature': 'Quinn',
+            'services': [{'service_id': purchased_service.id, 'price_plan': plan.id, 'total_amount': '0'}],
+            **payload,
+        }, format='json')
+
+    def test_total_is_priced_when_left_out(self):
+        purchase = self.create_quote([self.service])
+        self.assertEqual(purchase.total_amount, self.SERVICE_TOTAL + 5)
+        purchased_service = purchase.service_plans.get()
+        self.assertEqual(purchased_service.answers_price, Decimal('20.50'))
+        self.assertEqual(purchased_service.selected_plan.price, Decimal('9.50'))
+
+    def test_matching_client_total_is_accepted(self):
+        purchase = self.create_quote([self.service], total_amount='35.00')
+        self.assertEqual(purchase.total_amount, Decimal('35.00'))
+
+    def test_mismatching_client_total_is_rejected(self):
+        response = self.client.post(
+            '/api/data/purchase/', {**self.quote_payload([self.service]), 'total_amount': '1.00'}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['total_amount'], ['Total should be 35.00'])
+
+    @override_settings(PRICING_STRICT=False)
+    def test_lenient_mode_stores_priced_total(self):
+        purchase = self.create_quote([self.service], total_amount='1.00')
+        self.assertEqual(purchase.total_amount, Decimal('35.00'))
+
+    def test_minimum_price_raises_total(self):
+        settings = GlobalSettings.load()
+        settings.minimum_price = 100
+        settings.save()
+        invalidate_global_settings()
+        self.assertEqual(self.create_quote([self.service]).total_amount, Decimal('100.00'))
+
+    def test_submission_prices_selected_plan(self):
+        purchase = self.create_quote([self.service])
+        plan = purchase.service_plans.get().snapshot_plans().get(name='Plan 0')
+
+        response = self.submit(purchase, plan)
+        self.assertEqual(response.status_code, 200, response.data)
+        purchase.refresh_from_db()
+        self.assertTrue(purchase.is_submited)
+        self.assertEqual(purchase.total_amount, Decimal('35.50'))
+
+    def test_submission_rejects_plan_of_another_service(self):
+        purchase = self.create_quote([self.service])
+        other = self.create_quote([self.make_service('Raking')]).service_plans.get().snapshot_plans().first()
+
+        response = self.submit(purchase, other)
+        self.assertEqual(response.status_code, 400)
+        purchase.refresh_from_db()
+        self.assertFalse(purchase.is_submited)
+
+    def test_update_reprices_added_services(self):
+        purchase = self.create_quote([self.service])
+        added = self.make_service('Raking')
+        payload = self.quote_payload([added])
+        payload['custom_products'] = []
+
+        response = self.client.put('/api/data/purchase/', {**payload, 'purchase_id': purchase.id}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        purchase.refresh_from_db()
+        self.assertEqual(purchase.total_amount, 2 * self.SERVICE_TOTAL + 5)
+
+    def test_update_with_wrong_total_is_rejected(self):
+        purchase = self.create_quote([self.service])
+        payload = {**self.quote_payload([self.make_service('Raking')]), 'purchase_id': purchase.id, 'total_amount': '35.00'}
+
+        response = self.client.put('/api/data/purchase/', payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(str(response.data['total_amount']), 'Total should be 70.00')
+        self.assertEqual(purchase.service_plans.count(), 1)
+
+    def test_negative_option_quantity_is_rejected(self):
+        payload = self.quote_payload([self.service])
+        choice = next(q for q in payload['services'][0]['questions'] if q['options'])
+        choice['options'] = {'small': -5}
+
+        response = self.client.post('/api/data/purchase/', payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Purchase.objects.filter(contact=self.contact).exists())
+
+    def test_legacy_quote_keeps_client_total(self):
+        self.assertIsNone(quote_total([(None, None)], [], Decimal('0')))
+        self.assertEqual(check_total('total_amount', Decimal('12.00'), None, 'legacy', legacy=True), Decimal('12.00'))
+        with self.assertRaises(serializers.ValidationError):
+            check_total('total_amount', None, None, 'legacy', legacy=True)
+
+    def test_unpriceable_new_quote_never_keeps_client_total(self):
+        with self.assertRaises(serializers.ValidationError):
+            check_total('total_amount', Decimal('12.00'), None, 'new purchase')
+
+    def test_plan_of_another_service_is_rejected(self):
+        other = self.make_service('Raking')
+        payload = self.quote_payload([self.service])
+        payload['services'][0]['price_plan'] = other.pricing_options.first().id
+
+        response = self.client.post('/api/data/purchase/', {**payload, 'total_amount': '1.00'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('is not offered for service', response.data['services'][0])
+        self.assertFalse(Purchase.objects.filter(contact=self.contact).exists())
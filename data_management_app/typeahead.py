@@ -0,0 +1,213 @@
+"""
+In-memory prefix index for the contact picker.
+
+Each process keeps, per location, a sorted list of ``(key, contact pk)`` pairs
+where the keys are the lowercased names, email and phone digits of a contact.
+A lookup is a binary search to the first key starting with the typed prefix
+followed by a short scan, so it never touches the database.
+
+Writers report changes through ``contact_saved`` / ``contact_deleted`` /
+``reload_location``; the change is applied locally and broadcast so the other
+processes apply it too. A location is loaded from the database the first time
+it is looked up, or for every location at startup by ``warm_indexes``.
+"""
+import re
+import threading
+from bisect import bisect_left, insort
+
+from arman_backend.local_cache import ensure_listener, publish, subscribe
+from data_management_app.models import Contact, normalize_phone
+
+
+TOPIC = 'typeahead'
+ENTRY_FIELDS = ['id', 'contact_id', 'first_name', 'last_name', 'email', 'phone', 'phone_digits']
+
+# Phone numbers are also indexed by their last digits, i.e. without the country code
+NATIONAL_NUMBER_DIGITS = 10
+
+# A typed phone number, with the usual punctuation: "+1 (555) 010-2030", "555.010"
+PHONE_QUERY = re.compile(r'[\d\s()+.\-]*\d[\d\s()+.\-]*')
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def contact_entry(contact):
+    """The fields of a Contact kept in the index and returned by lookups"""
+    return {field: getattr(contact, field) for field in ENTRY_FIELDS}
+
+
+def index_keys(entry):
+    keys = set()
+    first = (entry.get('first_name') or '').strip().lower()
+    last = (entry.get('last_name') or '').strip().lower()
+    for name in (first, last, f"{first} {last}".strip()):
+        if name:
+            keys.add(name)
+    email = (entry.get('email') or '').strip().lower()
+    if email:
+        keys.add(email)
+    digits = entry.get('phone_digits')
+    if digits:
+        keys.add(digits)
+        # Numbers are typed without the country code as often as with it
+        keys.add(digits[-NATIONAL_NUMBER_DIGITS:])
+    return sorted(keys)
+
+
+def query_terms(query):
+    """
+    Lowercased words of a lookup; phone numbers are reduced to their digits like
+    the indexed ones, as one term when the whole query is a number
+    """
+    if PHONE_QUERY.fullmatch(query.strip()):
+        digits = normalize_phone(query)
+        return [digits] if digits else []
+    return [
+        (normalize_phone(term) or term) if PHONE_QUERY.fullmatch(term) else term
+        for term in query.lower().split()
+    ]
+
+
+class PrefixIndex:
+    """
+    Sorted prefix index over the contacts of one location
+    """
+
+    def __init__(self, entries=()):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._entry_keys = {}
+        self._keys = []
+        for entry in entries:
+            keys = index_keys(entry)
+            self._entries[entry['id']] = entry
+            self._entry_keys[entry['id']] = keys
+            self._keys.extend((key, entry['id']) for key in keys)
+        self._keys.sort()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def upsert(self, entry):
+        with self._lock:
+            self._remove(entry['id'])
+            keys = index_keys(entry)
+            self._entries[entry['id']] = entry
+            self._entry_keys[entry['id']] = keys
+            for key in keys:
+                insort(self._keys, (key, entry['id']))
+
+    def remove(self, pk):
+        with self._lock:
+            self._remove(pk)
+
+    def _remove(self, pk):
+        self._entries.pop(pk, None)
+        for key in self._entry_keys.pop(pk, []):
+            position = bisect_left(self._keys, (key, pk))
+            if position < len(self._keys) and self._keys[position] == (key, pk):
+                del self._keys[position]
+
+    def lookup(self, query, limit=10):
+        """
+        Contacts having a key starting with every word of ``query``
+        (the phone digits when the query is a number)
+        """
+        terms = query_terms(query)
+        if not terms:
+            return []
+        with self._lock:
+            # Whole-key prefix first ("john sm" matches "john smith"), then per word
+            candidates = self._scan(' '.join(terms), limit)
+            if len(candidates) < limit and len(terms) > 1:
+                seen = set(candidates)
+                # Walk the narrowest term's range and check the other terms on each contact
+                narrowest = min(terms, key=lambda term: len(range(*self._range(term))))
+                for pk in self._scan(narrowest, None):
+                    keys = self._entry_keys.get(pk, [])
+                    if pk in seen or not all(any(key.startswith(term) for key in keys) for term in terms):
+                        continue
+                    candidates.append(pk)
+                    if len(candidates) == limit:
+                        break
+            return [self._entries[pk] for pk in candidates]
+
+    def _range(self, prefix):
+        return bisect_left(self._keys, (prefix,)), bisect_left(self._keys, (prefix + '\uffff',))
+
+    def _scan(self, prefix, limit):
+        found, seen = [], set()
+        start, end = self._range(prefix)
+        for position in range(start, end):
+            pk = self._keys[position][1]
+            if pk not in seen:
+                seen.add(pk)
+                found.append(pk)
+                if limit is not None and len(found) == limit:
+                    break
+        return found
+
+
+def get_index(location_id):
+    ensure_listener()
+    index = _indexes.get(location_id)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(location_id)
+            if index is None:
+                index = _indexes[location_id] = _load_index(location_id)
+    return index
+
+
+def _load_index(location_id):
+    entries = Contact.objects.for_location(location_id).values(*ENTRY_FIELDS).iterator(chunk_size=5000)
+    return PrefixIndex(entries)
+
+
+def warm_indexes():
+    """
+    Load the index of every location into this process
+    """
+    location_ids = Contact.objects.order_by().values_list('location_id', flat=True).distinct()
+    for location_id in location_ids:
+        get_index(location_id)
+    print(f"Typeahead indexes loaded for {len(_indexes)} locations")
+
+
+def lookup(location_id, query, limit=10):
+    return get_index(location_id).lookup(query, limit)
+
+
+def contact_saved(contact):
+    publish(TOPIC, {'location_id': contact.location_id, 'entry': contact_entry(contact)})
+
+
+def contact_deleted(location_id, pk):
+    publish(TOPIC, {'location_id': location_id, 'deleted': pk})
+
+
+def reload_location(location_id):
+    """
+    Drop the index of a location after a bulk sync, it is reloaded on the next lookup
+    """
+    publish(TOPIC, {'location_id': location_id, 'reload': True})
+
+
+def _on_change(message):
+    location_id = message.get('location_id')
+    if message.get('reload'):
+        with _indexes_lock:
+            _indexes.pop(location_id, None)
+        return
+    # Locations this process hasn't loaded yet will read the change from the database
+    index = _indexes.get(location_id)
+    if index is None:
+        return
+    if message.get('deleted') is not None:
+        index.remove(message['deleted'])
+    else:
+        index.upsert(message['entry'])
+
+
+subscribe(TOPIC, _on_change)
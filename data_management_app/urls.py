@@ -8,6 +8,7 @@ router.register(r'services', ServiceViewSet, basename='service')
 urlpatterns = [
     path("webhook",webhook_handler),
     path('contacts/search/', ContactSearchView.as_view(), name='contact-search'),
+    path('contacts/autocomplete/', ContactAutocompleteView.as_view(), name='contact-autocomplete'),
     path('api/', include(router.urls)),
     path('purchase/', CreatePurchaseView.as_view(), name='create-purchase'),
     path('user/review/<int:id>/', ReviewView.as_view()),
@@ -15,6 +16,7 @@ urlpatterns = [
     path('quotes/<int:quoteId>/submit/', FinalSubmition.as_view()),
     path('validate/location/', validate_locationId.as_view()),
     path("create-invoice-webhook",GhlWebhookView.as_view() , name="webhook"),
+    path('invoice-jobs/<int:id>/', InvoiceJobStatusView.as_view(), name='invoice-job-status'),
     path('purchased-service/delete/<int:id>/', PurchasedServiceDelete.as_view()),
     path('custom-product/delete/<int:id>/', CustomProductDelete.as_view()),
     path('address/by-contact/<str:contact_id>/', AddressByContactView.as_view(), name='address-by-contact'),
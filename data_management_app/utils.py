@@ -1,13 +1,79 @@
 import requests
+import json
+import hashlib
+import logging
+from django.core.cache import cache
 
-from accounts.models import GHLAuthCredentials
+from accounts.credentials import get_credentials
 from data_management_app.models import Contact
 
+logger = logging.getLogger(__name__)
 
-def update_contact(contact_id, data):
+
+# GHL answers each of our contact writes with a ContactUpdate webhook; we remember
+# what we wrote for this long so the echo can be recognized and dropped
+ECHO_TTL = 120
+ECHO_SUPPRESSED_KEY = 'ghl-echo:suppressed'
+FINGERPRINT_FIELDS = ['firstName', 'lastName', 'email', 'phone', 'dnd', 'country', 'address1', 'city', 'state', 'postalCode']
+
+
+def contact_fingerprint(contact_data):
+    """
+    Hash of the contact state carried by a GHL contact payload (API response or webhook)
+    """
+    state = {field: contact_data.get(field) or None for field in FINGERPRINT_FIELDS}
+    state['tags'] = sorted(tag.lower() for tag in contact_data.get('tags') or [])
+    state['customFields'] = sorted(
+        (str(cf.get('id')), json.dumps(cf.get('value', cf.get('field_value')), sort_keys=True, default=str))
+        for cf in contact_data.get('customFields') or []
+        if cf.get('value', cf.get('field_value')) not in (None, '', [])
+    )
+    return hashlib.sha256(json.dumps(state, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def echo_key(contact_id, fingerprint):
+    return f"ghl-echo:{contact_id}:{fingerprint}"
+
+
+def record_own_write(contact_data):
+    """
+    Remember the contact state returned by one of our PUTs so its webhook echo can be recognized
+    """
+    if not contact_data or not contact_data.get('id'):
+        return
+    cache.add(echo_key(contact_data['id'], contact_fingerprint(contact_data)), True, timeout=ECHO_TTL)
+
+
+def is_own_echo(data):
+    """
+    True when a ContactUpdate webhook only reports the state we just wrote ourselves.
+    Each recorded write is matched at most once: the delete that consumes it is atomic.
+    """
+    contact_id = data.get('id')
+    if not contact_id:
+        return False
+    if not cache.delete(echo_key(contact_id, contact_fingerprint(data))):
+        return False
+    cache.add(ECHO_SUPPRESSED_KEY, 0, timeout=None)
+    suppressed = cache.incr(ECHO_SUPPRESSED_KEY)
+    logger.info("Suppressed webhook echo for contact %s (%s so far)", contact_id, suppressed)
+    return True
+
+
+def suppressed_echo_count():
+    """How many webhook echoes of our own writes were dropped, across all processes"""
+    return cache.get(ECHO_SUPPRESSED_KEY, 0)
+
+
+def update_contact(contact_id, data, location_id=None):
     url = f'https://services.leadconnectorhq.com/contacts/{contact_id}'
-    credentials = GHLAuthCredentials.objects.first()
+    if not location_id:
+        location_id = Contact.objects.filter(contact_id=contact_id).values_list('location_id', flat=True).first()
+    credentials = get_credentials(location_id)
     print(credentials, 'creee')
+    if not credentials:
+        print(f"No GHL credentials for location {location_id}, contact {contact_id} not updated")
+        return {'error': 'Authentication credentials not found'}
 
     headers = {
         'Authorization': f'Bearer {credentials.access_token}',
@@ -18,6 +84,8 @@ def update_contact(contact_id, data):
     try:
         response = requests.put(url, headers=headers, json=data)
         print(response.json(), 'responseeeeee')
+        if response.status_code == 200:
+            record_own_write(response.json().get('contact'))
         return response.json()
     except Exception as e:
         print(e, 'errorrr')
@@ -25,9 +93,11 @@ def update_contact(contact_id, data):
     
 def add_tags(contact_id, plan_name=None):
     url = f'https://services.leadconnectorhq.com/contacts/{contact_id}'
-    credentials = GHLAuthCredentials.objects.first()
 
     contact = Contact.objects.filter(contact_id=contact_id).first()
+    if not contact:
+        return False
+    credentials = get_credentials(contact.location_id)
     tags = contact.tags or []
     if "Quote Accepted" not in tags:
         tags.append("Quote Accepted")
@@ -38,6 +108,9 @@ def add_tags(contact_id, plan_name=None):
     contact.tags = tags
     contact.save()
 
+    if not credentials:
+        print(f"No GHL credentials for location {contact.location_id}, tags of {contact_id} not pushed")
+        return False
 
     headers = {
         'Authorization': f'Bearer {credentials.access_token}',
@@ -53,6 +126,7 @@ def add_tags(contact_id, plan_name=None):
         response = requests.put(url, headers=headers, json=payload)
         print(response.status_code, response.text)
         if response.status_code == 200:
+            record_own_write(response.json().get('contact'))
             return response.json()
         else:
             return False
@@ -62,8 +136,6 @@ def add_tags(contact_id, plan_name=None):
 
 def add_custom_field(contact_id, access_token, data):
     url = f'https://services.leadconnectorhq.com/contacts/{contact_id}'
-    credentials = GHLAuthCredentials.objects.first()
-    print(credentials, 'creee')
 
     headers = {
         'Authorization': f'Bearer {access_token}',
@@ -1,33 +1,42 @@
 from django.shortcuts import render
 from data_management_app.tasks import handle_webhook_event
 import json
+import hashlib
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+from rest_framework.renderers import JSONRenderer
 from data_management_app.models import WebhookLog
-from data_management_app.tasks import handle_webhook_event
+from data_management_app.tasks import handle_webhook_event, process_invoice_job
 from rest_framework.generics import ListAPIView
-from django.db.models import Q
+from django.db.models import prefetch_related_objects
 from .models import Contact, Address
-from .serializers import ContactSerializer, AddressSerializer
-from .pagination import ContactPagination
+from .serializers import ContactSerializer, AddressSerializer, wanted_fields
+from .pagination import ContactPagination, ContactCursorPagination
+from . import typeahead
+from .catalog import cached_catalog_response, clone_service
+from .global_settings import get_global_settings
+from .pricing import check_total, is_legacy_purchase, price_purchase, reprice_purchase
+from .purchase_documents import get_review, review_delta, save_purchase_document
+from .search import search_contacts, search_phone, SEARCH_MODES, PHONE_MATCHES, MIN_PHONE_SUFFIX
+from rest_framework.exceptions import ValidationError
 from rest_framework import viewsets, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from django.db import transaction
+from django.db import transaction, IntegrityError
 from django.shortcuts import get_object_or_404
-from .models import Service, GlobalSettings, Purchase, PurchasedService, CustomProduct
+from .models import Service, GlobalSettings, Purchase, PurchasedService, CustomProduct, InvoiceJob
 from .serializers import ServiceSerializer
-from .serializers import PurchaseCreateSerializer, GlobalSettingsSerializer, PurchaseDetailSerializer, FinalSubmissionSerializer
+from .serializers import PurchaseCreateSerializer, GlobalSettingsSerializer, FinalSubmissionSerializer, InvoiceJobSerializer
 from rest_framework.views import APIView
-from .utils import update_contact, add_tags, add_custom_field
-from accounts.models import GHLAuthCredentials
+from .utils import update_contact, add_tags, add_custom_field, is_own_echo
+from accounts.credentials import get_credentials
 
 
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from django.views import View
-from data_management_app.services import get_or_create_product, create_invoice
 
 
 
@@ -40,8 +49,10 @@ def webhook_handler(request):
     try:
         data = json.loads(request.body)
         print("date:----- ", data)
-        WebhookLog.objects.create(data=data)
         event_type = data.get("type")
+        if event_type == "ContactUpdate" and is_own_echo(data):
+            return JsonResponse({"message": "Echo ignored"}, status=200)
+        WebhookLog.objects.create(data=data)
         handle_webhook_event.delay(data, event_type)
         return JsonResponse({"message":"Webhook received"}, status=200)
     except Exception as e:
@@ -53,28 +64,93 @@ class ContactSearchView(ListAPIView):
     serializer_class = ContactSerializer
     pagination_class = ContactPagination
 
+    @property
+    def paginator(self):
+        # ?pagination=cursor switches to keyset pages ordered by (date_added, id), ranked searches by (rank, date_added, id)
+        if not hasattr(self, '_paginator'):
+            if self.request.query_params.get('pagination') == 'cursor':
+                self._paginator = ContactCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
     def get_queryset(self):
         query = self.request.query_params.get('search', '').strip()
-        qs = Contact.objects.all()
+        mode = self.request.query_params.get('mode', 'contains')
+        if mode not in SEARCH_MODES:
+            raise ValidationError({'mode': f"Must be one of {', '.join(SEARCH_MODES)}"})
+
+        columns = [
+            field.name for field in Contact._meta.concrete_fields
+            if field.name not in ContactSerializer.Meta.exclude
+        ]
+        # id and date_added are always loaded for ordering and cursors
+        qs = Contact.objects.only('id', 'date_added', *wanted_fields(self.request, columns))
+        location_id = self.request.query_params.get('location_id')
+        if location_id:
+            qs = qs.for_location(location_id)
+
+        phone = self.request.query_params.get('phone', '').strip()
+        if phone:
+            phone_match = self.request.query_params.get('phone_match', 'exact')
+            if phone_match not in PHONE_MATCHES:
+                raise ValidationError({'phone_match': f"Must be one of {', '.join(PHONE_MATCHES)}"})
+            qs = search_phone(qs, phone, phone_match)
+            if qs is None:
+                raise ValidationError({'phone': f"Must contain at least {MIN_PHONE_SUFFIX} digits"})
+            if not query:
+                return qs
+
+        return search_contacts(qs, query, mode)
+
+
+
+
+
 
-        if query:
-            keywords = query.split()
-            q_object = Q()
-            for keyword in keywords:
-                q_object |= Q(first_name__icontains=keyword)
-                q_object |= Q(last_name__icontains=keyword)
-                q_object |= Q(email__icontains=keyword)
-                q_object |= Q(phone__icontains=keyword)
-                q_object |= Q(country__icontains=keyword)
-            qs = qs.filter(q_object)
 
-        return qs.order_by('-date_added')
 
+class ContactAutocompleteView(APIView):
+    """
+    Contact picker suggestions served from the in-memory typeahead index
+    """
+    max_limit = 25
 
+    def get(self, request):
+        location_id = request.query_params.get('location_id')
+        if not location_id:
+            return Response({'error': 'location_id is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 10)), self.max_limit))
+        except (TypeError, ValueError):
+            return Response({'error': 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+
+        results = typeahead.lookup(location_id, request.query_params.get('q', ''), limit)
+        return Response({'results': results}, status=status.HTTP_200_OK)
 
 
+def conditional_json_response(request, content, etag, status=200):
+    """
+    Rendered JSON with its ETag, or 304 when If-None-Match already names it
+    """
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(content, content_type='application/json', status=status)
+    response['ETag'] = etag
+    return response
 
 
+def wants_delta(request):
+    return request.query_params.get('response') == 'delta'
+
+
+# Prefetches needed by each nested collection of ServiceSerializer
+SERVICE_PREFETCHES = {
+    'features': 'features',
+    'pricingOptions': 'pricing_options__selected_features__feature',
+    'questions': 'questions__options',
+}
 
 
 class ServiceViewSet(viewsets.ModelViewSet):
@@ -85,6 +161,29 @@ class ServiceViewSet(viewsets.ModelViewSet):
     ).all()
     serializer_class = ServiceSerializer
 
+    def get_queryset(self):
+        if self.request.method not in ('GET', 'HEAD'):
+            return self.queryset.all()
+        expansions = wanted_fields(self.request, SERVICE_PREFETCHES, expandable=SERVICE_PREFETCHES)
+        columns = wanted_fields(self.request, [field.name for field in Service._meta.concrete_fields])
+        return Service.objects.only('id', *columns).prefetch_related(
+            *(SERVICE_PREFETCHES[name] for name in expansions)
+        )
+
+    def cached_response(self, request, build):
+        """
+        Serve a catalog read from the cache of the current catalog version,
+        answering 304 when the client already has this body
+        """
+        content, etag = cached_catalog_response(request, lambda: JSONRenderer().render(build()))
+        return conditional_json_response(request, content, etag)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: self.get_serializer(self.get_queryset(), many=True).data)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: self.get_serializer(self.get_object()).data)
+
     def create(self, request, *args, **kwargs):
         """
         Create a new service with nested data
@@ -95,15 +194,15 @@ class ServiceViewSet(viewsets.ModelViewSet):
             # Handle array of services
             services_data = data['services']
             minimum_price = data.get('minimumPrice', 0)
-            
-            created_services = []
             for service_data in services_data:
                 service_data['minimumPrice'] = minimum_price
-                serializer = self.get_serializer(data=service_data)
-                serializer.is_valid(raise_exception=True)
-                service = serializer.save()
-                created_services.append(service)
-            
+
+            # All services are validated first, then written together in bulk
+            serializer = self.get_serializer(data=services_data, many=True)
+            serializer.is_valid(raise_exception=True)
+            created_services = serializer.save()
+            prefetch_related_objects(created_services, *SERVICE_PREFETCHES.values())
+
             # Return all created services
             response_serializer = self.get_serializer(created_services, many=True)
             return Response(response_serializer.data, status=status.HTTP_201_CREATED)
@@ -112,6 +211,7 @@ class ServiceViewSet(viewsets.ModelViewSet):
             serializer = self.get_serializer(data=data)
             serializer.is_valid(raise_exception=True)
             service = serializer.save()
+            prefetch_related_objects([service], *SERVICE_PREFETCHES.values())
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def update(self, request, *args, **kwargs):
@@ -150,9 +250,9 @@ class ServiceViewSet(viewsets.ModelViewSet):
         """
         Get only active services
         """
-        active_services = self.queryset.filter(is_active=True)
-        serializer = self.get_serializer(active_services, many=True)
-        return Response(serializer.data)
+        return self.cached_response(request, lambda: self.get_serializer(
+            self.get_queryset().filter(is_active=True), many=True
+        ).data)
 
     @action(detail=True, methods=['post'])
     def duplicate(self, request, pk=None):
@@ -160,23 +260,10 @@ class ServiceViewSet(viewsets.ModelViewSet):
         Duplicate a service with all its related data
         """
         original_service = self.get_object()
-        serializer = self.get_serializer(original_service)
-        data = serializer.data
-        
-        # Modify name to indicate it's a copy
-        data['name'] = f"{data['name']} (Copy)"
-        
-        # Remove read-only fields
-        data.pop('id', None)
-        data.pop('created_at', None)
-        data.pop('updated_at', None)
-        
-        # Create new service
-        new_serializer = self.get_serializer(data=data)
-        new_serializer.is_valid(raise_exception=True)
-        new_service = new_serializer.save()
-        
-        return Response(new_serializer.data, status=status.HTTP_201_CREATED)
+        new_service = clone_service(original_service)
+        prefetch_related_objects([new_service], *SERVICE_PREFETCHES.values())
+        serializer = self.get_serializer(new_service)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
 
@@ -187,14 +274,16 @@ class CreatePurchaseView(APIView):
         contact_id=request.data.get('contact')
         serializer = PurchaseCreateSerializer(data=request.data)
         if serializer.is_valid():
-            purchase = serializer.save()
+            with transaction.atomic():
+                purchase = serializer.save()
+                save_purchase_document(purchase)
             data = {"customFields": [
                 {
                     "id": "Bff2eZtlr82uvVQmByPh", #custom field id
                     "field_value": f'{settings.FRONTEND_URL}/user/review/{purchase.id}/'
                 }
             ]}
-            res = update_contact(contact_id, data)
+            res = update_contact(contact_id, data, location_id=purchase.contact.location_id)
             return Response({"message": "Purchase created successfully", "id": purchase.id}, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
@@ -207,23 +296,24 @@ class CreatePurchaseView(APIView):
 
         serializer = PurchaseCreateSerializer(instance=purchase, data=request.data, partial=True)
         if serializer.is_valid():
-            serializer.save()
+            with transaction.atomic():
+                purchase = serializer.save()
+                save_purchase_document(purchase)
             return Response({'message': 'Services added successfully'}, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
 class ReviewView(APIView):
     def get(self, request, id):
         try:
-            purchase = Purchase.objects.get(id=id)
-            serializer = PurchaseDetailSerializer(purchase)
-            return Response(serializer.data, status=200)
+            content, etag = get_review(id, request.query_params.get('location_id'))
         except Purchase.DoesNotExist:
             return Response({'error':'not found'}, status=404)
+        return conditional_json_response(request, content, etag)
 
     
 class globalsettingsView(APIView):
     def get(self, request):
-        global_settings = GlobalSettings.load()
+        global_settings = get_global_settings()
         serializer = GlobalSettingsSerializer(global_settings)
         return Response(serializer.data)
 
@@ -240,6 +330,7 @@ class FinalSubmition(APIView):
         purchase_id = request.data.get('purchase_id')
         purchase=Purchase.objects.get(id=purchase_id)
         contact_id = purchase.contact.contact_id
+        location_id = purchase.contact.location_id
         serializer = FinalSubmissionSerializer(data=request.data)
         if serializer.is_valid():
             data = serializer.validated_data
@@ -248,27 +339,41 @@ class FinalSubmition(APIView):
             # Update purchase
             purchase.is_submited = True
             purchase.signature = data['signature']
-            purchase.total_amount = data['total_amount']
-            purchase.save()
-
-            # Update each PurchasedServicePlan
-            for service_data in data['services']:
-                try:
-                    purchased_plan = PurchasedService.objects.get(
-                        id=service_data['service_id']
-                    )
+
+            plan_names = []
+            with transaction.atomic():
+                # Update each PurchasedServicePlan
+                for service_data in data['services']:
+                    try:
+                        purchased_plan = PurchasedService.objects.get(
+                            id=service_data['service_id']
+                        )
+                    except PurchasedService.DoesNotExist:
+                        # Rolls back the plans already switched, nothing of the submission is kept
+                        raise ValidationError(
+                            {"detail": f"PurchasedServicePlan for service {service_data['service_id']} not found"}
+                        )
                     price_plan = service_data['price_plan']
                     purchased_plan.selected_plan = price_plan
                     purchased_plan.save()
+                    plan_names.append(price_plan.name)
+
+                # Priced from the plan and answer prices recorded on the quote
+                purchase.total_amount = check_total(
+                    'total_amount', data.get('total_amount'),
+                    price_purchase(purchase, get_global_settings().minimum_price), f"purchase {purchase.id}",
+                    legacy=is_legacy_purchase(purchase),
+                )
+                purchase.save()
+                save_purchase_document(purchase)
+
+            # The quote is final now, render its review into the cache once
+            get_review(purchase.id)
+
+            #add plan_name as a tag in ghl contact
+            for plan_name in plan_names:
+                add_tags(contact_id, plan_name=plan_name)
 
-                    #add plan_name as a tag in ghl contact
-                    add_tags(contact_id, plan_name=price_plan.name)
-                    
-                except PurchasedService.DoesNotExist:
-                    return Response(
-                        {"detail": f"PurchasedServicePlan for service {service_data['service_id']} not found"},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
             if add_tags(contact_id):
                 data = {"customFields": [
                     {
@@ -276,7 +381,7 @@ class FinalSubmition(APIView):
                         "field_value": float(purchase.total_amount)
                     }
                 ]}
-                res = update_contact(contact_id, data)
+                res = update_contact(contact_id, data, location_id=location_id)
                 return Response({"detail": "Submission completed successfully."}, status=status.HTTP_200_OK)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -287,9 +392,9 @@ class validate_locationId(APIView):
         if not location_id:
             return Response({'error':'locationId not found'}, status=401)
         
-        credentials = GHLAuthCredentials.objects.first()
+        credentials = get_credentials(location_id)
         
-        if location_id != credentials.location_id:
+        if not credentials:
             return Response({'error':'Unauthenticated locationId'}, status=401)
         
         return Response({'status':True},status=200)
@@ -309,11 +414,7 @@ class GhlWebhookView(View):
             if not location_id:
                 return JsonResponse({"error": "Location ID not found in webhook data"}, status=400)
             
-            # Get authentication token
-            try:
-                token = GHLAuthCredentials.objects.get(location_id=location_id)
-                access_token = token.access_token
-            except GHLAuthCredentials.DoesNotExist:
+            if not get_credentials(location_id):
                 return JsonResponse({"error": "Authentication credentials not found"}, status=400)
             
             # Check if product name exists in custom data
@@ -323,26 +424,44 @@ class GhlWebhookView(View):
             if not product_name:
                 return JsonResponse({"error": "Product Name not found in custom data"}, status=400)
             
-            # Get or create product
-            product_id = get_or_create_product(access_token, location_id, product_name, custom_data)
-            
-            if not product_id:
-                return JsonResponse({"error": "Failed to get or create product"}, status=500)
-            
-            # Create invoice
-            invoice_result = create_invoice(access_token, webhook_data, product_id, product_name)
+            # A redelivered webhook carries the same body, so it maps to the same job
+            idempotency_key = request.headers.get("Idempotency-Key") or hashlib.sha256(
+                json.dumps(webhook_data, sort_keys=True).encode()
+            ).hexdigest()
 
-            print("invoice result: :", invoice_result)
-            
-            if invoice_result:
-                return JsonResponse({"success": True, "invoice_id": invoice_result.get("id")})
-            else:
-                return JsonResponse({"error": "Failed to create invoice"}, status=500)
+            try:
+                job, created = InvoiceJob.objects.get_or_create(
+                    idempotency_key=idempotency_key,
+                    defaults={"location_id": location_id, "payload": webhook_data}
+                )
+            except IntegrityError:
+                job, created = InvoiceJob.objects.get(idempotency_key=idempotency_key), False
+
+            if created:
+                process_invoice_job.delay(job.id)
+
+            return JsonResponse({
+                "success": True,
+                "job_id": job.id,
+                "status": job.status,
+                "duplicate": not created,
+                "invoice_id": job.invoice_id,
+            }, status=202)
                 
         except json.JSONDecodeError:
             return JsonResponse({"error": "Invalid JSON data"}, status=400)
         except Exception as e:
             return JsonResponse({"error": str(e)}, status=500)
+
+
+class InvoiceJobStatusView(APIView):
+    def get(self, request, id):
+        try:
+            job = InvoiceJob.objects.get(id=id)
+        except InvoiceJob.DoesNotExist:
+            return Response({'error': 'Invoice job not found'}, status=status.HTTP_404_NOT_FOUND)
+        serializer = InvoiceJobSerializer(job)
+        return Response(serializer.data, status=status.HTTP_200_OK)
     
 
 class PurchasedServiceDelete(APIView):
@@ -350,11 +469,17 @@ class PurchasedServiceDelete(APIView):
         try:
             service=PurchasedService.objects.get(id=id)
             purchase_id = service.purchase.id
-            service.delete()
+            with transaction.atomic():
+                service.delete()
+                # The total drops with the line, store it before the document is rendered
+                reprice_purchase(service.purchase, get_global_settings().minimum_price)
+                document = save_purchase_document(service.purchase)
+            # ?response=delta: just the removed id, totals and version, the editor patches its copy
+            if wants_delta(request):
+                return Response(review_delta(document, id), status=200)
             try:
-                purchase = Purchase.objects.get(id=purchase_id)
-                serializer = PurchaseDetailSerializer(purchase)
-                return Response(serializer.data, status=200)
+                content, etag = get_review(purchase_id)
+                return conditional_json_response(request, content, etag)
             except Purchase.DoesNotExist:
                 return Response({'error':'not found'}, status=404)
         except PurchasedService.DoesNotExist:
@@ -365,11 +490,16 @@ class CustomProductDelete(APIView):
         try:
             cumstom_product=CustomProduct.objects.get(id=id)
             purchase_id = cumstom_product.purchase.id
-            cumstom_product.delete()
+            with transaction.atomic():
+                cumstom_product.delete()
+                # The total drops with the line, store it before the document is rendered
+                reprice_purchase(cumstom_product.purchase, get_global_settings().minimum_price)
+                document = save_purchase_document(cumstom_product.purchase)
+            if wants_delta(request):
+                return Response(review_delta(document, id), status=200)
             try:
-                purchase = Purchase.objects.get(id=purchase_id)
-                serializer = PurchaseDetailSerializer(purchase)
-                return Response(serializer.data, status=200)
+                content, etag = get_review(purchase_id)
+                return conditional_json_response(request, content, etag)
             except Purchase.DoesNotExist:
                 return Response({'error':'not found'}, status=404)
         except CustomProduct.DoesNotExist:
@@ -380,5 +510,8 @@ class AddressByContactView(APIView):
         if not contact_id:
             return Response({'error': 'contact_id is required'}, status=status.HTTP_400_BAD_REQUEST)
         addresses = Address.objects.filter(contact=contact_id)
+        location_id = request.query_params.get('location_id')
+        if location_id:
+            addresses = addresses.for_location(location_id)
         serializer = AddressSerializer(addresses, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
\ No newline at end of file